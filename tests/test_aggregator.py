@@ -0,0 +1,76 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+################################################################################
+
+'''
+tests summing scores with spilled and merged runs
+'''
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'tools'))
+
+from aggregator import Aggregator
+
+
+class TestAggregator(unittest.TestCase):
+    def setUp(self):
+        random.seed(0)
+        self.items = [(('rel%d' % random.randint(0, 200), 'arg'), 1.0)
+                      for n in xrange(2000)]
+        self.sums = defaultdict(float)
+        for key, score in self.items:
+            self.sums[key] += score
+
+    def aggregate(self, capacity, fan_in):
+        aggregator = Aggregator(capacity, fan_in=fan_in)
+        for key, score in self.items:
+            aggregator.add(key, score)
+        return aggregator
+
+    def test_in_memory(self):
+        aggregator = self.aggregate(1000, 4)
+        self.assertEqual(aggregator.runs, [])
+        self.assertEqual(list(aggregator.items()), sorted(self.sums.items()))
+
+    def test_more_runs_than_fan_in(self):
+        aggregator = self.aggregate(10, 4)
+        self.assertTrue(len(aggregator.runs) > 4 * 4)
+        items = aggregator.items()
+        first = next(items)
+        # runs are merged down to the fan in before they are read
+        self.assertTrue(len(aggregator.runs) <= 4)
+        self.assertEqual([first] + list(items), sorted(self.sums.items()))
+        self.assertEqual(aggregator.runs, [])
+
+    def test_resume_from_named_runs(self):
+        # runs spilled to named files before an interruption are summed with
+        # the items added after it by a new aggregator
+        tmpdir = tempfile.mkdtemp()
+        try:
+            prefix = os.path.join(tmpdir, 'run')
+            half = len(self.items) / 2
+            aggregator = Aggregator(10, prefix=prefix)
+            for key, score in self.items[:half]:
+                aggregator.add(key, score)
+            aggregator.spill()
+            paths = list(aggregator.paths)
+            self.assertTrue(all(os.path.exists(path) for path in paths))
+            aggregator = Aggregator(10, fan_in=4, prefix=prefix, runs=paths)
+            for key, score in self.items[half:]:
+                aggregator.add(key, score)
+            self.assertEqual(aggregator.paths[:len(paths)], paths)
+            self.assertEqual(list(aggregator.items()),
+                             sorted(self.sums.items()))
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    unittest.main()
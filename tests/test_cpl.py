@@ -0,0 +1,133 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+################################################################################
+
+'''
+tests the order in which CPLManager schedules the tasks of mutually
+exclusive relations, with workers that run in this process
+'''
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+from ConfigParser import ConfigParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'tools'))
+
+import cpl
+
+RELS = ['a', 'b', 'c', 'd']
+MUTEX = {'a': ['b'], 'b': ['a', 'c'], 'c': ['b', 'd'], 'd': ['c']}
+
+
+def promoted(method, rel, it):
+    '''returns the items promoted by method for rel at iteration it'''
+    if method == 'iterate_p':
+        return ['%s%d' % (rel, it)]
+    return [('%s%d' % (rel, it), )]
+
+
+class FakeManager(cpl.CPLManager):
+    '''a CPLManager whose tasks are finished in random order by receive
+    instead of being sent to worker processes'''
+    def start_workers(self):
+        self.idle = range(self.workers)
+        self.running = []
+        self.log = []
+
+    def stop_workers(self):
+        pass
+
+    def dispatch(self, cost, rel, it, method, *args):
+        self.running.append((self.idle.pop(), rel, it, method, args))
+        self.log.append(('start', rel, it, method, args))
+
+    def receive(self):
+        w, rel, it, method, args = self.running.pop(
+            random.randrange(len(self.running)))
+        self.idle.append(w)
+        self.log.append(('done', rel, it, method, args))
+        cost = random.randint(0, 10)
+        return rel, it, method, promoted(method, rel, it), cost
+
+
+class TestSchedule(unittest.TestCase):
+    def setUp(self):
+        random.seed(0)
+        self.tmpdir = tempfile.mkdtemp()
+        self.config = ConfigParser()
+        for section in ('mongo', 'boot', 'general', 'mutex', 'seeds'):
+            self.config.add_section(section)
+        for k, v in (('host', 'localhost'), ('port', '1979'),
+                     ('db', 'test_cpl'), ('matrix', 'm_2')):
+            self.config.set('mongo', k, v)
+        for k, v in (('scorer', 'ReliabilityScorer'), ('keep', 'false'),
+                     ('reset', 'false'), ('n', '10'), ('workers', '2')):
+            self.config.set('boot', k, v)
+        self.config.set('general', 'rels', ','.join(RELS))
+        for rel in RELS:
+            self.config.set('mutex', rel, ','.join(MUTEX[rel]))
+            seeds = os.path.join(self.tmpdir, rel)
+            open(seeds, 'w').write('x\ty\n' * (RELS.index(rel) + 1))
+            self.config.set('seeds', rel, seeds)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def schedule(self, start=1, stop=3):
+        manager = FakeManager(self.config)
+        manager.start_workers()
+        manager.schedule(start, stop)
+        return manager
+
+    def test_tasks_wait_for_mutex_relations(self):
+        for workers in ('1', '2', '4'):
+            self.config.set('boot', 'workers', workers)
+            for n in xrange(20):
+                manager = self.schedule()
+                done = set()
+                for event, rel, it, method, args in manager.log:
+                    if event == 'done':
+                        done.add((method, rel, it))
+                        continue
+                    # the instances of the iteration before or the patterns
+                    # of this iteration of rel and its mutex relations
+                    if method == 'iterate_p':
+                        needs = [('iterate_i' if it > 1 else 'state_I',
+                                  m, it-1) for m in [rel] + MUTEX[rel]]
+                    elif method == 'iterate_i':
+                        needs = [('iterate_p', m, it)
+                                 for m in [rel] + MUTEX[rel]]
+                    else:
+                        continue
+                    for need in needs:
+                        self.assertIn(need, done)
+                    # and are sent the items promoted by the mutex relations
+                    self.assertEqual(args[0], {need[1]: promoted(*need)
+                                               for need in needs[1:]})
+
+    def test_every_task_runs_once(self):
+        manager = self.schedule(2, 4)
+        started = [(method, rel, it)
+                   for event, rel, it, method, args in manager.log
+                   if event == 'start']
+        expected = [('state_I', rel, 1) for rel in RELS]
+        expected += [(method, rel, it) for rel in RELS for it in (2, 3, 4)
+                     for method in ('iterate_p', 'iterate_i')]
+        self.assertEqual(sorted(started), sorted(expected))
+        self.assertEqual(manager.running, [])
+
+    def test_unknown_mutex_relation(self):
+        self.config.set('mutex', 'd', 'e')
+        self.assertRaises(ValueError, self.schedule)
+
+    def test_no_workers(self):
+        self.config.set('boot', 'workers', '0')
+        self.assertRaises(ValueError, FakeManager, self.config)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+################################################################################
+
+'''
+tests resuming an interrupted ingest from its checkpoints. requires the
+test mongod started by `tools/mongo_utils` (localhost:1979, or
+$MONGO_HOST and $MONGO_PORT)
+'''
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'tools'))
+
+import pymongo
+from pymongo.errors import ConnectionFailure
+
+import instances2matrix
+
+HOST = os.environ.get('MONGO_HOST', 'localhost')
+PORT = int(os.environ.get('MONGO_PORT', 1979))
+DB = 'test_ingest'
+
+DATA = os.path.join(os.path.dirname(__file__), 'data', 'reverb',
+                    'wikipedia_1000.txt')
+
+
+class Interrupt(Exception):
+    pass
+
+
+def interrupt_after(n, f):
+    '''returns a generator function that yields from f and raises Interrupt
+    after n items have been yielded over all its calls'''
+    left = [n]
+    def g(*args, **kwargs):
+        for x in f(*args, **kwargs):
+            if not left[0]:
+                raise Interrupt()
+            left[0] -= 1
+            yield x
+    return g
+
+
+class TestResumeIngest(unittest.TestCase):
+    def setUp(self):
+        try:
+            self.connection = pymongo.MongoClient(HOST, PORT)
+        except ConnectionFailure:
+            self.skipTest('no mongod on %s:%d' % (HOST, PORT))
+        self.connection.drop_database(DB)
+        self.db = self.connection[DB]
+        self.tmpdir = tempfile.mkdtemp()
+        # the first lines appear in both files, so their tuples are summed
+        # across files
+        lines = open(DATA).readlines()
+        self.files = [os.path.join(self.tmpdir, 'a.txt'),
+                      os.path.join(self.tmpdir, 'b.txt')]
+        open(self.files[0], 'w').writelines(lines[:600])
+        open(self.files[1], 'w').writelines(lines[:100] + lines[600:])
+
+    def tearDown(self):
+        self.connection.drop_database(DB)
+        self.connection.close()
+        shutil.rmtree(self.tmpdir)
+
+    def ingest(self, collection, capacity=50, every=100):
+        return instances2matrix.create_collection_parallel(
+            HOST, PORT, DB, collection, self.files, 1, batch=7,
+            capacity=capacity, tmpdir=self.tmpdir, every=every
+            )
+
+    def docs(self, collection):
+        return sorted((x['rel'], x['arg1'], x['arg2'], x['score'])
+                      for x in self.db['%s_2' % collection].find())
+
+    def run_dirs(self):
+        return [d for d in os.listdir(self.tmpdir) if '_ingest_' in d]
+
+    def assertResumes(self, name, n, capacity=50):
+        # an interrupted ingest resumed by running it again writes the same
+        # documents as one that was not interrupted
+        self.ingest('full', capacity, every=0)
+        original = getattr(instances2matrix, name)
+        setattr(instances2matrix, name, interrupt_after(n, original))
+        try:
+            self.assertRaises(Interrupt, self.ingest, 'm', capacity)
+        finally:
+            setattr(instances2matrix, name, original)
+        self.ingest('m', capacity)
+        self.assertEqual(self.docs('m'), self.docs('full'))
+        self.assertEqual(self.run_dirs(), [])
+
+    def test_aggregated_tuples_are_written_once(self):
+        self.ingest('m')
+        docs = self.docs('m')
+        keys = [x[:3] for x in docs]
+        self.assertEqual(len(keys), len(set(keys)))
+        self.assertEqual(sum(x[3] for x in docs), 1100.0)
+
+    def test_resume_interrupted_read(self):
+        self.assertResumes('read_shard', 750)
+
+    def test_resume_interrupted_write(self):
+        self.assertResumes('aggregated_instances', 300)
+
+    def test_resume_interrupted_unaggregated(self):
+        self.assertResumes('read_shard', 750, capacity=0)
+
+    def test_finished_ingest_is_skipped(self):
+        self.ingest('m')
+        docs = self.docs('m')
+        self.assertEqual(self.ingest('m'), 0)
+        self.assertEqual(self.docs('m'), docs)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+################################################################################
+
+'''
+tests counting the mongodb calls and documents returned by the stages of
+bootstrapping iterations
+'''
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'tools'))
+
+from instrument import Instrument, summarize
+
+
+class Cursor(object):
+    def __init__(self, docs):
+        self.docs = list(docs)
+
+    def __iter__(self):
+        return iter(self.docs)
+
+    def next(self):
+        if not self.docs:
+            raise StopIteration
+        return self.docs.pop(0)
+
+    def limit(self, n):
+        self.docs = self.docs[:n]
+        return self
+
+    def count(self):
+        return len(self.docs)
+
+
+class Collection(object):
+    def __init__(self, docs):
+        self.docs = docs
+
+    def find(self, query=None):
+        return Cursor(self.docs)
+
+    def find_one(self, query=None):
+        return self.docs[0] if self.docs else None
+
+    def insert(self, docs):
+        self.docs.extend(docs)
+
+
+class Database(object):
+    def __init__(self):
+        self.collections = {}
+
+    def __getitem__(self, name):
+        return self.collections.setdefault(name, Collection([]))
+
+    def collection_names(self):
+        return self.collections.keys()
+
+
+class TestInstrument(unittest.TestCase):
+    def setUp(self):
+        self.stats = Instrument('test')
+        self.db = self.stats.wrap(Database())
+        self.db['c'].insert([{'_id': n} for n in xrange(5)])
+        self.stats.take()
+
+    def test_counts_calls_and_returned_documents(self):
+        with self.stats.stage(1, 'p', 'get_I'):
+            cursor = self.db['c'].find().limit(3)
+            self.assertEqual(cursor.count(), 3)
+            self.assertEqual(len(list(cursor)), 3)
+            self.db['c'].find_one()
+            self.db['empty'].find_one()
+            self.db.collection_names()
+        [r] = self.stats.take()
+        # find, count, two find_ones, and collection_names
+        self.assertEqual(r['calls'], 5)
+        self.assertEqual(r['returned'], 4)
+        self.assertEqual((r['it'], r['phase'], r['stage']), (1, 'p', 'get_I'))
+
+    def test_summarize(self):
+        for it, stage in ((1, 'rank'), (1, 'save'), (2, 'rank')):
+            with self.stats.stage(it, 'p', stage):
+                self.db['c'].find_one()
+        totals = summarize(self.stats.records, ('phase', 'stage'))
+        self.assertEqual(totals.keys(), [('p', 'rank'), ('p', 'save')])
+        self.assertEqual(totals[('p', 'rank')]['calls'], 2)
+        self.assertEqual(totals[('p', 'rank')]['returned'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
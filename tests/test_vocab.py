@@ -0,0 +1,88 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+################################################################################
+
+'''
+tests encoding a matrix with a vocabulary. the tests of TestEncodedMatrix
+require the test mongod started by `tools/mongo_utils` (localhost:1979,
+or $MONGO_HOST and $MONGO_PORT)
+'''
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'tools'))
+
+import pymongo
+from pymongo.errors import ConnectionFailure
+
+import instances2matrix
+import matrix2pmi
+import mongodb
+from vocab import Vocabulary
+
+HOST = os.environ.get('MONGO_HOST', 'localhost')
+PORT = int(os.environ.get('MONGO_PORT', 1979))
+DB = 'test_vocab'
+
+INSTANCES = [
+    instances2matrix.Instance(1.0, 'test', 'lived in', 2, ['Ann', 'Paris']),
+    instances2matrix.Instance(1.0, 'test', 'lived in', 2, ['Bob', 'Rome']),
+    instances2matrix.Instance(1.0, 'test', 'was born in', 2, ['Ann', 'Rome']),
+    ]
+
+
+class TestQuery(unittest.TestCase):
+    def test_make_query_keeps_lowest_ids(self):
+        q = mongodb.make_query(i=(0, 1), p=0)
+        self.assertEqual(q.items(), [('rel', 0), ('arg1', 0), ('arg2', 1)])
+
+
+class TestEncodedMatrix(unittest.TestCase):
+    def setUp(self):
+        try:
+            self.connection = pymongo.Connection(HOST, PORT)
+        except ConnectionFailure:
+            self.skipTest('no mongod on %s:%d' % (HOST, PORT))
+        self.connection.drop_database(DB)
+        self.db = self.connection[DB]
+
+    def tearDown(self):
+        self.connection.drop_database(DB)
+        self.connection.disconnect()
+
+    def test_ids_start_at_1(self):
+        vocab = Vocabulary(self.db, 'm')
+        ids = vocab.encode_many(['a', 'b', 'c'])
+        self.assertEqual(sorted(ids.values()), [1, 2, 3])
+
+    def test_lookup_does_not_add(self):
+        Vocabulary(self.db, 'm').encode_many(['a'])
+        vocab = Vocabulary(self.db, 'm')
+        self.assertEqual(vocab.lookup_many(['a', 'b']), {'a': 1})
+        self.assertEqual(self.db['m_vocab'].find({'s': 'b'}).count(), 0)
+
+    def test_encoded_matrix(self):
+        # the first pattern and argument are encoded with the lowest ids
+        instances2matrix.create_collection(self.db, 'm', INSTANCES,
+                                           encode=True)
+        vocab = Vocabulary(self.db, 'm')
+        ids = vocab.encode_many(['lived in', 'was born in', 'Ann', 'Rome'])
+        self.assertEqual(min(x['_id'] for x in
+                             self.db['m_vocab'].find({'s': {'$exists': 1}})),
+                         1)
+        pmi = matrix2pmi.PMI(self.db, 'm_2')
+        pmi.make_F()
+        pmi.make_pmi_ip()
+        rel, ann, rome = ids['lived in'], ids['Ann'], ids['Rome']
+        self.assertEqual(pmi.F_p_many([rel]), {rel: 2.0})
+        # pairs that do not co-occur default to 0.0 without being stored
+        F_ip = pmi.F_ip_block([(ann, rome)], [rel])
+        self.assertEqual(F_ip[((ann, rome), rel)], 0.0)
+        self.assertNotIn(('F_ip', (ann, rome), rel), pmi.cache)
+        self.assertEqual(pmi.F_ip((ann, rome), ids['was born in']), 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Author: Eric Nichols, <eric@ecei.tohoku.ac.jp>
+################################################################################
+
+'''
+`aggregator.py`: sums scores over keys in a bounded-memory hash table,
+spilling sorted runs to disk when the table fills and merging them when
+the results are read. at most FAN_IN runs are merged at once, so that the
+number of open files is bounded however many runs are spilled. runs
+can be spilled to named files that outlive the aggregator, so that an
+interrupted aggregation can be resumed from them
+'''
+
+import heapq
+import marshal
+import os
+import sys
+import tempfile
+from itertools import groupby
+from operator import itemgetter
+
+FAN_IN = 64
+
+def read_run(f):
+    '''yields (key, score) items marshalled to f'''
+    f.seek(0)
+    while True:
+        try:
+            yield marshal.load(f)
+        except EOFError:
+            return
+
+def open_run(run):
+    '''returns the file of run, opening it if run is the path of a run
+    spilled to a named file'''
+    if isinstance(run, basestring):
+        return open(run, 'rb')
+    return run
+
+def merge(runs):
+    '''yields (key, sum of scores) in key order for the items of runs
+    sorted by key'''
+    for key, group in groupby(heapq.merge(*runs), key=itemgetter(0)):
+        yield key, sum(score for k, score in group)
+
+
+class Aggregator:
+    def __init__(self, capacity=1000000, tmpdir=None, fan_in=FAN_IN,
+                 prefix=None, runs=()):
+        '''initializes an aggregator holding at most capacity keys in
+        memory, spilling runs to files in tmpdir and merging at most fan_in
+        of them at once. if prefix is given, runs are spilled to the files
+        <prefix>.<n> instead, which are kept. the runs previously spilled
+        to the files runs are read as well'''
+        self.capacity = capacity
+        self.tmpdir = tmpdir
+        self.fan_in = fan_in
+        self.prefix = prefix
+        self.table = {}
+        # temporary files, or the paths of runs spilled to named files,
+        # which are only opened while they are merged
+        self.runs = list(runs)
+        self.paths = list(runs)
+
+    def add(self, key, score):
+        '''adds score to the sum for key, spilling the table if it is full'''
+        self.table[key] = self.table.get(key, 0.0) + score
+        if len(self.table) >= self.capacity:
+            self.spill()
+
+    def spill(self):
+        '''writes the table to disk as a run sorted by key and empties it.
+        runs spilled to <prefix>.<n> are synced to disk and added to
+        paths'''
+        if not self.table:
+            return
+        if self.prefix:
+            path = '%s.%d' % (self.prefix, len(self.paths))
+            f = open(path, 'wb')
+        else:
+            f = tempfile.TemporaryFile(dir=self.tmpdir)
+        for item in sorted(self.table.iteritems()):
+            marshal.dump(item, f)
+        if self.prefix:
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+            self.paths.append(path)
+            self.runs.append(path)
+        else:
+            self.runs.append(f)
+        print >>sys.stderr, '# spilled run %d: %d keys' % \
+            (len(self.runs), len(self.table))
+        self.table = {}
+
+    def merge_runs(self):
+        '''merges the oldest fan_in spilled runs into one run until at most
+        fan_in runs remain'''
+        while len(self.runs) > self.fan_in:
+            runs = [open_run(r) for r in self.runs[:self.fan_in]]
+            f = tempfile.TemporaryFile(dir=self.tmpdir)
+            for item in merge([read_run(r) for r in runs]):
+                marshal.dump(item, f)
+            for r in runs:
+                r.close()
+            self.runs = self.runs[self.fan_in:] + [f]
+            print >>sys.stderr, '# merged %d runs: %d runs left' % \
+                (len(runs), len(self.runs))
+
+    def items(self):
+        '''yields (key, sum of scores) for all keys in key order, merging
+        spilled runs with the table, and resets the aggregator. the files
+        of runs spilled to <prefix>.<n> are left for the caller to
+        remove'''
+        self.merge_runs()
+        files = [open_run(r) for r in self.runs]
+        runs = [read_run(f) for f in files]
+        runs.append(iter(sorted(self.table.iteritems())))
+        self.table = {}
+        for item in merge(runs):
+            yield item
+        for f in files:
+            f.close()
+        self.runs = []
+        self.paths = []
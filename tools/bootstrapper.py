@@ -3,16 +3,26 @@
 # Author: Eric Nichols, <eric@ecei.tohoku.ac.jp>
 ################################################################################
 
+import cPickle
 import pymongo
 import sys
+import zlib
+from bson.binary import Binary
+from bson.son import SON
 
+import instrument
 import mongodb
-from matrix2pmi import PMI
+import vocab
+from matrix2pmi import PMI, BLOCK
 
+# the order of the phases of an iteration
+PHASES = ('p', 'i')
 
 class Bootstrapper:
     def __init__(self, host, port, db, matrix, rel,
-                 seeds, n, keep, reset, scorer, it=1):
+                 seeds, n, keep, reset, scorer, it=1,
+                 cache_size=100000, cache_policy='lru', engine='mongo',
+                 artifact=None, report=None):
         self.host = host
         self.port = port
         self.db = db
@@ -24,37 +34,76 @@ class Bootstrapper:
         self.reset = reset
         self.scorer_class = scorer
         self.it = it
+        self.cache_size = cache_size
+        self.cache_policy = cache_policy
+        self.engine = engine
+        self.artifact = artifact
+        self.report = report
+        self.state = None
         self.set_collection_names()
         self.init_connection()
 
+    def stage(self, phase, stage):
+        '''returns a context recording the wall time, mongodb calls, and
+        documents returned by stage of phase (p or i) of the current
+        iteration'''
+        return self.stats.stage(self.it, phase, stage)
+
     def set_collection_names(self):
         boot_i_args = [self.matrix, self.rel, self.__short__, 'i',
                        self.scorer_class.__short__]
         boot_p_args = [self.matrix, self.rel, self.__short__, 'p',
                        self.scorer_class.__short__]
+        boot_s_args = [self.matrix, self.rel, self.__short__, 's',
+                       self.scorer_class.__short__]
         if self.keep:
             boot_i_args.append('keep')
             boot_p_args.append('keep')
+            boot_s_args.append('keep')
         else:
             boot_i_args.append('nokeep')
             boot_p_args.append('nokeep')
+            boot_s_args.append('nokeep')
         self.boot_i = '_'.join(boot_i_args)
         self.logger.info('boot_i: %s' % self.boot_i)
         self.boot_p = '_'.join(boot_p_args)
         self.logger.info('boot_p: %s' % self.boot_p)
+        self.boot_s = '_'.join(boot_s_args)
+        self.logger.info('boot_s: %s' % self.boot_s)
 
     def init_connection(self):
         self.logger.info('initializing mongodb connection ...')
         self.connection = pymongo.Connection(self.host, self.port)
-        self.db = self.connection[self.db]
+        self.stats = instrument.Instrument(self.rel, self.report)
+        self.db = self.stats.wrap(self.connection[self.db])
         self.logger.info('initializing mongodb connection: done')
         self.args = self.get_args()
+        self.vocab = vocab.open_vocabulary(self.db, self.matrix)
         self.scorer = self.scorer_class(
-            self.db, self.matrix, self.boot_i, self.boot_p, self.logger
+            self.db, self.matrix, self.boot_i, self.boot_p, self.logger,
+            self.cache_size, self.cache_policy
             )
+        if self.engine == 'memory':
+            self.load_memory()
         if self.reset: self.do_reset()
         if not self.has_seeds(): self.add_seeds()
 
+    def load_memory(self):
+        '''replaces the PMI look ups of the scorer with the matrix and its
+        scores loaded into memory, or memory mapped from artifact if it is
+        given'''
+        import memory_pmi
+        self.logger.info('loading matrix into memory ...')
+        if self.artifact:
+            self.scorer.pmi = memory_pmi.open_artifact(self.artifact)
+        else:
+            self.scorer.pmi = memory_pmi.MemoryPMI(
+                *memory_pmi.calculate(self.scorer.pmi)
+                )
+        self.scorer.max_pmi = self.scorer.pmi.max_pmi()
+        self.logger.info('loading matrix into memory: done. %s' % 
+                         self.scorer.pmi.stats())
+
     def get_args(self):
         '''returns a lists of argument names in <matrix>'''
         x = self.db[self.matrix].find_one()
@@ -74,73 +123,224 @@ class Bootstrapper:
         return self.has_run(self.db, self.boot_i, 0)
 
     def add_seeds(self):
-        '''adds seeds to db.coll with reliability score of 1.0'''
+        '''adds seeds to db.coll with reliability score of 1.0 in one bulk
+        upsert, encoding their arguments if the matrix is encoded. seeds
+        with arguments that are not in the vocabulary do not occur in the
+        matrix and are skipped'''
         self.logger.debug('add_seeds: %d %s' % 
                           (len(self.seeds), self.seeds))
-        for s in self.seeds:
-            self.logger.debug('seed: %s' % s)
-            args = s.split('\t')
+        seeds = [s.split('\t') for s in self.seeds]
+        if self.vocab:
+            ids = self.vocab.lookup_many([a for args in seeds for a in args])
+            for args in seeds:
+                if not all(a in ids for a in args):
+                    self.logger.warning('seed not in vocabulary: %s' % 
+                                        '\t'.join(args))
+            seeds = [[ids[a] for a in args] for args in seeds
+                     if all(a in ids for a in args)]
+        docs = []
+        for args in seeds:
+            self.logger.debug('seed: %s' % args)
             doc = {'arg%d'%n:v
                    for n,v in enumerate(args, 1)}
             doc['it'] = 0
             doc['score'] = 1.0
-            mongodb.cache(self.db, self.boot_i, doc)
+            docs.append(doc)
+        self.save_I(docs)
 
-    def get_I(self, it, query={}):
-        '''retrieves instances that match query from iteration it'''
-        if self.keep:
-            query['it'] = {'$lte':it}
-        else:
-            query['it'] = it
-        return [tuple( [v
-                       for k,v in sorted(r.items()) 
-                       if k.startswith('arg')] )
-                for r in mongodb.fast_find(
-                self.db, self.boot_i, query, fields=self.args
-                ) ]
-
-    def get_P(self, it, query={}):
-        '''retrieves patterns that match query from iteration it'''
-        if self.keep:
-            query['it'] = {'$lte':it}
-        else:
-            query['it'] = it
-        return [r['rel'] 
-                for r in mongodb.fast_find(
-                self.db, self.boot_p, query, fields=['rel']
-                ) ]
+    def save_I(self, rs):
+        '''saves promoted instances rs to boot_i with one bulk upsert keyed
+        on iteration and arguments'''
+        mongodb.upsert_many(self.db, self.boot_i, rs, ['it'] + self.args)
+
+    def save_P(self, rs):
+        '''saves promoted patterns rs to boot_p with one bulk upsert keyed
+        on iteration and pattern'''
+        mongodb.upsert_many(self.db, self.boot_p, rs, ['it', 'rel'])
+
+    def promoted_P(self):
+        '''returns the set of patterns promoted in any iteration of the
+        current state, or in boot_p if there is no state'''
+        if self.state:
+            return set(self.state['p'])
+        return set(r['rel'] 
+                   for r in self.db[self.boot_p].find({}, fields=['rel']))
+
+    def promoted_I(self):
+        '''returns the set of instances promoted in any iteration of the
+        current state, or in boot_i if there is no state, including the
+        seeds'''
+        if self.state:
+            return set(self.state['i'])
+        return set(tuple(r.get(a) for a in self.args)
+                   for r in self.db[self.boot_i].find({}, fields=self.args))
+
+    def read_state(self, it, phase):
+        '''returns the state after phase (i or p) of iteration it read from
+        boot_i and boot_p: dictionaries mapping the promoted instances and
+        patterns to the iteration they were promoted in and their score'''
+        state = {'it': it, 'phase': phase, 'i': {}, 'p': {}}
+        last_i = it if phase == 'i' else it-1
+        for r in mongodb.fast_find(self.db, self.boot_i,
+                                   {'it': {'$lte': last_i}},
+                                   fields=self.args + ['it', 'score']):
+            i = tuple(r.get(a) for a in self.args)
+            state['i'].setdefault(i, (r['it'], r.get('score', 0.0)))
+        for r in mongodb.fast_find(self.db, self.boot_p,
+                                   {'it': {'$lte': it}},
+                                   fields=['rel', 'it', 'score']):
+            state['p'].setdefault(r['rel'], (r['it'], r.get('score', 0.0)))
+        return state
+
+    def load_snapshot(self, it, phase):
+        '''returns the state after phase (i or p) of iteration it, rebuilt
+        from the snapshots of the phases up to it, or None if there is no
+        snapshot of it or the snapshots before it are incomplete'''
+        rs = [r for r in self.db[self.boot_s].find({'it': {'$lte': it}})
+              if (r['it'], PHASES.index(r['phase'])) <=
+                 (it, PHASES.index(phase))]
+        rs.sort(key=lambda r: (r['it'], PHASES.index(r['phase'])))
+        if not rs or (rs[-1]['it'], rs[-1]['phase']) != (it, phase):
+            return None
+        state = {'it': it, 'phase': phase, 'i': {}, 'p': {}}
+        for r in rs:
+            delta = cPickle.loads(zlib.decompress(r['delta']))
+            for x in ('i', 'p'):
+                for k, v in delta[x].iteritems():
+                    state[x].setdefault(k, v)
+        if (len(state['i']), len(state['p'])) != (rs[-1]['I'], rs[-1]['P']):
+            self.logger.warning('snapshots up to %s %d are incomplete' % 
+                                (phase, it))
+            return None
+        return state
+
+    def save_snapshot(self, delta):
+        '''saves the items of delta, dictionaries of the instances (i) and
+        patterns (p) added to the state by its phase, to boot_s as a
+        compressed snapshot of the phase and iteration of the state, with
+        the number of instances and patterns in the state'''
+        s = self.state
+        doc = {'it': s['it'], 'phase': s['phase'],
+               'I': len(s['i']), 'P': len(s['p']),
+               'delta': Binary(zlib.compress(cPickle.dumps(delta, 2)))}
+        mongodb.upsert_many(self.db, self.boot_s, [doc], ['it', 'phase'])
+
+    def restore(self, it, phase):
+        '''makes the state after phase (i or p) of iteration it current,
+        loading it from its snapshots in one query or, if there are none,
+        from boot_i and boot_p, in which case the whole state is saved as
+        its snapshot so later snapshots only need what their phase adds.
+        the scorer looks up the scores of promoted items in the state'''
+        s = self.state
+        if s and (s['it'], s['phase']) == (it, phase):
+            return
+        self.logger.info('restoring state after %s %d ...' % (phase, it))
+        self.state = self.load_snapshot(it, phase)
+        source = 'snapshot'
+        if self.state is None:
+            self.state = self.read_state(it, phase)
+            self.save_snapshot(self.state)
+            source = 'collections'
+        self.scorer.memo = self.state
+        self.logger.info('restoring state after %s %d: done. %d I, %d P from %s' % 
+                         (phase, it, len(self.state['i']),
+                          len(self.state['p']), source))
+
+    def promote(self, phase, rs):
+        '''adds the instances or patterns rs promoted in phase (i or p) of
+        the current iteration to the state and saves a snapshot of the
+        items it added. the snapshot is saved before rs, so that a phase
+        whose snapshot cannot be saved leaves no promoted items behind'''
+        s = self.state
+        delta = {'i': {}, 'p': {}}
+        for r in rs:
+            if phase == 'i':
+                x = tuple(r[a] for a in self.args)
+            else:
+                x = r['rel']
+            if x not in s[phase]:
+                s[phase][x] = delta[phase][x] = (r['it'], r['score'])
+        s['it'], s['phase'] = self.it, phase
+        self.save_snapshot(delta)
+
+    def state_items(self, x, it):
+        '''returns the instances (x=i) or patterns (x=p) of the current
+        state that were promoted in iteration it, or up to it if keep'''
+        return sorted(k for k, (j, score) in self.state[x].iteritems()
+                      if j == it or (self.keep and j <= it))
+
+    def state_I(self, it):
+        '''retrieves instances promoted in iteration it, or up to it if
+        keep, from the state after iteration it'''
+        self.restore(it, 'i')
+        return self.state_items('i', it)
+
+    def state_P(self, it):
+        '''retrieves patterns promoted in iteration it, or up to it if keep,
+        from the state after the pattern phase of iteration it'''
+        self.restore(it, 'p')
+        return self.state_items('p', it)
+
+    def match_P(self, I):
+        '''yields (p, number of matching rows) for patterns that match
+        instances in I. matching patterns are grouped on the server with
+        one aggregation per block of instances, or read from the matrix in
+        memory'''
+        if self.engine == 'memory':
+            for r in self.scorer.pmi.match_P(I):
+                yield r
+            return
+        for chunk in mongodb.chunks(I, BLOCK):
+            pipeline = [
+                {'$match': {'$or': [mongodb.make_query(i=i,p=None)
+                                    for i in chunk]}},
+                {'$group': {'_id': '$rel', 'n': {'$sum': 1}}},
+                ]
+            for r in mongodb.aggregate(self.db, self.matrix, pipeline):
+                yield r['_id'], r['n']
+
+    def match_I(self, P):
+        '''yields (i, number of matching rows) for instances that match
+        patterns in P. matching instances are grouped on the server with
+        one aggregation per block of patterns, or read from the matrix in
+        memory'''
+        if self.engine == 'memory':
+            for r in self.scorer.pmi.match_I(P):
+                yield r
+            return
+        group = SON((a, '$%s' % a) for a in self.args)
+        for chunk in mongodb.chunks(P, BLOCK):
+            pipeline = [
+                {'$match': {'rel': {'$in': chunk}}},
+                {'$group': {'_id': group, 'n': {'$sum': 1}}},
+                ]
+            for r in mongodb.aggregate(self.db, self.matrix, pipeline):
+                yield tuple(r['_id'][a] for a in self.args), r['n']
 
     def I2P(self, I):
         '''retrieve patterns that match promoted instances in I and
         have not been retrieved in past iteration'''
-        P = [r['rel']
-             for i in I
-             for r in mongodb.fast_find(
-                self.db, self.matrix, 
-                mongodb.make_query(i=i,p=None), fields=['rel']
-                )
-             if not self.db[self.boot_p].find_one({'rel':r['rel']}) ]
-        P_ = tuple(sorted(set(P)))
-        self.logger.info('P: %d => %d' % (len(P), len(P_)))
+        promoted = self.promoted_P()
+        P, n = set(), 0
+        for p, count in self.match_P(I):
+            if p not in promoted:
+                P.add(p)
+                n += count
+        P_ = tuple(sorted(P))
+        self.logger.info('P: %d => %d' % (n, len(P_)))
         return P_
 
     def P2I(self, P):
         '''retrieve instances that match promoted patterns in P and
         have not been retrieved in past iteration'''
-        I = [tuple( [v
-                     for k,v in sorted(r.items())
-                     if k.startswith('arg')] )
-             for p in P
-             for r in mongodb.fast_find(
-                self.db, self.matrix, 
-                mongodb.make_query(i=None,p=p), fields=self.args
-                )
-             if not self.db[self.boot_i].find_one(
-                {k:v 
-                 for k,v in sorted(r.items())
-                 if k.startswith('arg')} ) ]
-        I_ = tuple(sorted(set(I)))
-        self.logger.info('I: %d => %d' % (len(I), len(I_)))
+        promoted = self.promoted_I()
+        I, n = set(), 0
+        for i, count in self.match_I(P):
+            if i not in promoted:
+                I.add(i)
+                n += count
+        I_ = tuple(sorted(I))
+        self.logger.info('I: %d => %d' % (n, len(I_)))
         return I_
 
     def iterate_p(self):
@@ -154,33 +354,41 @@ class Bootstrapper:
 
         # read promoted instances of last bootstrpping iteration
         self.logger.info('getting promoted instances...''')
-        I = self.get_I(self.it-1)
+        with self.stage('p', 'get_I'):
+            I = self.state_I(self.it-1)
         self.logger.info('I: %d' % len(I))
         self.logger.info('getting promoted instances: done.''')
 
         # find matching patterns
         self.logger.info('getting matching patterns...')
-        P = self.I2P(I)
+        with self.stage('p', 'I2P'):
+            P = self.I2P(I)
         self.logger.info('getting matching patterns: done.')
 
         # rank patterns by reliability score
         self.logger.info('ranking patterns ...')
-        rs = self.scorer.rank_patterns(I, P, self.it)
+        with self.stage('p', 'rank'):
+            rs = self.scorer.rank_patterns(I, P, self.it, self.n)
         self.logger.info('ranking patterns: done.')
 
         # save top n to <matrix>_boot_p
         self.logger.info('saving top %d patterns...' % self.n)
-        for r in rs[:self.n]:
+        for r in rs:
             self.logger.info('r: %s' % r)
-            mongodb.cache(self.db, self.boot_p, r)
+        with self.stage('p', 'snapshot'):
+            self.promote('p', rs)
+        with self.stage('p', 'save'):
+            self.save_P(rs)
         self.logger.info('saving top %d patterns: done.' % self.n)
 
         self.logger.info('ensuring indices ...')
-        # index for iteration number
-        self.db[self.boot_p].ensure_index( [('it', pymongo.DESCENDING), ] )
-        # index for <REL>
-        self.db[self.boot_p].ensure_index( [('rel', pymongo.ASCENDING), ] )
+        with self.stage('p', 'ensure_index'):
+            # index for iteration number
+            self.db[self.boot_p].ensure_index( [('it', pymongo.DESCENDING), ] )
+            # index for <REL>
+            self.db[self.boot_p].ensure_index( [('rel', pymongo.ASCENDING), ] )
         self.logger.info('ensuring indices: done.')
+        self.logger.info('PMI %s' % self.scorer.pmi.stats())
 
     def iterate_i(self):
         '''perform an iteration of bootstrapping saving n instances with the 
@@ -193,36 +401,44 @@ class Bootstrapper:
 
         # read promoted patterns of last bootstrpping iteration
         self.logger.info('getting promoted patterns...''')
-        P = self.get_P(self.it)
+        with self.stage('i', 'get_P'):
+            P = self.state_P(self.it)
         self.logger.info('P: %d' % len(P))
         self.logger.info('getting promoted patterns: done.''')
 
         # find matching instances
         self.logger.info('getting matching instances...')
-        I = self.P2I(P)
+        with self.stage('i', 'P2I'):
+            I = self.P2I(P)
         self.logger.info('getting matching instances: done.')
 
         # rank instances by reliability score
         self.logger.info('ranking instances ...')
-        rs = self.scorer.rank_instances(I, P, self.it)
+        with self.stage('i', 'rank'):
+            rs = self.scorer.rank_instances(I, P, self.it, self.n)
         self.logger.info('ranking instances: done.')
 
         # save top n to <matrix>_boot_p
         self.logger.info('saving top %d instances...' % self.n)
-        for r in rs[:self.n]:
-            self.logger.info('r:', r)
-            mongodb.cache(self.db, self.boot_i, r)
+        for r in rs:
+            self.logger.info('r: %s' % r)
+        with self.stage('i', 'snapshot'):
+            self.promote('i', rs)
+        with self.stage('i', 'save'):
+            self.save_I(rs)
         self.logger.info('saving top %d instances: done.' % self.n)
 
         self.logger.info('ensuring indices ...')
-        # index for iteration number
-        self.db[self.boot_i].ensure_index( [('it', pymongo.DESCENDING), ] )
-        # index for <ARGJ,...,ARGN>
-        self.db[self.boot_i].ensure_index(
-            [(arg, pymongo.ASCENDING)
-             for arg in self.args]
-            )
+        with self.stage('i', 'ensure_index'):
+            # index for iteration number
+            self.db[self.boot_i].ensure_index( [('it', pymongo.DESCENDING), ] )
+            # index for <ARGJ,...,ARGN>
+            self.db[self.boot_i].ensure_index(
+                [(arg, pymongo.ASCENDING)
+                 for arg in self.args]
+                )
         self.logger.info('ensuring indices: done.')
+        self.logger.info('PMI %s' % self.scorer.pmi.stats())
 
     def iterate(self):
         self.iterate_p()
@@ -234,15 +450,18 @@ class Bootstrapper:
         iteration start to stop'''
         for it in xrange(start, stop+1):
             self.iterate()
+        self.stats.print_summary()
 
     def do_reset(self):
         '''reset bootstrapping by deleting collections of bootstraped
         args and rels'''
         
         if self.it <= 1:
-            self.logger.info('resetting %s and %s ...' % 
-                             (self.boot_i, self.boot_p))
+            self.logger.info('resetting %s, %s, and %s ...' % 
+                             (self.boot_i, self.boot_p, self.boot_s))
             self.db.drop_collection(self.boot_i)
             self.db.drop_collection(self.boot_p)
-            self.logger.info('resetting %s and %s: done.' % 
-                             (self.boot_i, self.boot_p))
+            self.db.drop_collection(self.boot_s)
+            self.state = None
+            self.logger.info('resetting %s, %s, and %s: done.' % 
+                             (self.boot_i, self.boot_p, self.boot_s))
@@ -21,34 +21,91 @@ bootstrapping algorithm
 
 ### Caches Created
 
-Creates 2 caches of bootstrapped instances and patterns for the target 
+Creates 3 caches of bootstrapped instances and patterns for the target 
 relation:
 
 1. `<matrix>_<rel>_cpl_i`: bootstrapped instances for <rel>
 2. `<matrix>_<rel>_cpl_p`: bootstrapped patterns for <rel>
+3. `<matrix>_<rel>_cpl_s`: snapshots of each iteration for <rel> (see
+   `espresso.py`)
 
 ### Bootstrapping
 
 ...
+
+### Mutual Exclusion
+
+Candidate instances (patterns) are kept only if their co-occurence
+count with the promoted patterns (instances) is more than three times
+their co-occurence count with the items promoted by mutually exclusive
+relations. Co-occurence counts are retrieved for all candidates at
+once as a sparse matrix, the rule is applied to all of them as one
+array comparison, and the number of candidates each mutually exclusive
+relation rejects is logged.
+
+### Workers
+
+Relations are bootstrapped by `CPLWorker`s in a pool of long-lived
+processes, which keep the mongodb connection, PMI look ups, and caches
+of each relation they have been sent across iterations. The number of
+processes is set by `workers` in the `[boot]` section (default: the
+smaller of the number of relations and CPUs). `CPLManager` sends the
+processes tasks over queues, running the tasks with the most candidates
+in the last iteration first, and starts the next step of a relation as
+soon as the relations it is mutually exclusive with have promoted the
+instances or patterns it needs, rather than waiting for all relations.
+The items promoted by an iteration are returned with its result, so
+they are exchanged without further tasks, and a worker that hosts a
+relation continues from its snapshots when another worker ran its last
+phase. A worker that exits while running a task, e.g. killed for
+running out of memory, stops bootstrapping with an error instead of
+leaving `CPLManager` waiting for its result.
+
+Stages are timed as in `espresso.py`, including the mutual exclusion
+filter. Workers send their timings to `CPLManager` with their results,
+which prints the totals when bootstrapping finishes and appends them
+as JSON lines to `report` in the `[boot]` section if it is configured.
+
+With the memory engine (`engine = memory` in the `[boot]` section),
+`CPLManager` saves the matrix and its scores once as an artifact (see
+`sparse_pmi.py`) in a temporary directory, or in `artifact` if it is
+configured, and every worker memory maps the same read-only arrays
+instead of querying mongodb or holding its own copy.
 '''
 
 import fileinput
+import heapq
 import inspect
 import multiprocessing
+import os
 import pymongo
+import Queue
+import shutil
 import sys
+import tempfile
+import traceback
+from collections import defaultdict
 from ConfigParser import ConfigParser
 import logging
 
+import instrument
 import mongodb
 import scorers
 from bootstrapper import Bootstrapper
+from matrix2pmi import PMI
+
+STOP_TIMEOUT = 60
+POLL_INTERVAL = 5
 
 class CPLWorker(Bootstrapper):
     __short__ = 'cpl'
     def __init__(self, host, port, db, matrix, rel,
-                 seeds, n, keep, reset, scorer, it=1):
-        self.logger = multiprocessing.get_logger()
+                 seeds, n, keep, reset, scorer, it=1,
+                 cache_size=100000, cache_policy='lru', engine='mongo',
+                 artifact=None):
+        # a logger for each relation, as a worker process may host several
+        self.logger = logging.getLogger('multiprocessing.CPL.%s' % rel)
+        self.logger.propagate = False
         #self.logger.setLevel(logging.DEBUG)
         self.logger.setLevel(logging.INFO)
         #self.logger.setLevel(logging.WARNING)
@@ -63,41 +120,72 @@ class CPLWorker(Bootstrapper):
         self.boot_p = '%s_%s_cpl_p' % (matrix, rel)
         Bootstrapper.__init__(
             self, host, port, db, matrix, rel, 
-            seeds, n, keep, reset, scorer, it
+            seeds, n, keep, reset, scorer, it, cache_size, cache_policy,
+            engine, artifact
             )
 
     def mutex_pred2patterns(self, pred):
         return 
 
+    def mutex_cooc(self, F, index, xs, axis):
+        '''returns an array of the co-occurence counts of each candidate
+        with the items xs, summing the sparse co-occurence matrix F along
+        axis over the positions of xs in index'''
+        import numpy
+        positions = [index[x] for x in sorted(set(xs))]
+        F_ = F[:, positions] if axis == 1 else F[positions, :]
+        return numpy.asarray(F_.sum(axis=axis)).ravel()
+
+    def mutex_rule(self, F, index, promoted, mutexes, axis, name):
+        '''returns a boolean array that is true for candidates whose
+        co-occurence count with promoted is more than three times their
+        co-occurence count with the items of all mutually exclusive
+        relations in mutexes, logging the number of candidates each
+        mutex relation rejects on its own'''
+        cooc = self.mutex_cooc(F, index, promoted, axis)
+        for rel, xs in sorted(mutexes.iteritems()):
+            rejected = cooc <= 3.0*self.mutex_cooc(F, index, xs, axis)
+            self.logger.info('%s: %s rejected %d' % 
+                             (name, rel, rejected.sum()))
+        M = [x for xs in mutexes.itervalues() for x in xs]
+        return cooc > 3.0*self.mutex_cooc(F, index, M, axis)
+
     def mutex_filter_i(self, I, P, mutexes):
         '''filter out all candidate instances that have a co-occurence
         count less than three times the co-occurence count with
-        mutually exclusive predicates'''
-        self.logger.info('mutex_filter_i: %s' % 
-                         set.intersection(set(I), set(mutexes)))
-        def cooc(i, P):
-            return sum( [self.scorer.pmi.F_ip(i,p) for p in P] )
-        I_ = [i for i in I
-              if cooc(i, P) > 3.0*cooc(i, mutexes)]
+        mutually exclusive predicates. mutexes is a dictionary mapping each
+        mutually exclusive relation to its promoted patterns'''
+        M = set(p for ps in mutexes.itervalues() for p in ps)
+        Q = sorted(set(P) | M)
+        index = {q:n for n,q in enumerate(Q)}
+        F = self.scorer.pmi.submatrix(I, Q, 'F_ip').tocsc()
+        keep = self.mutex_rule(F, index, P, mutexes, 1, 'mutex_filter_i')
+        I_ = [i for i, k in zip(I, keep) if k]
         self.logger.info('mutex_filter_i: %d => %d' % (len(I), len(I_)))
         return I_
 
     def mutex_filter_p(self, I, P, mutexes):
-        '''filter out all candidate instances that have a co-occurence
+        '''filter out all candidate patterns that have a co-occurence
         count less than three times the co-occurence count with
-        mutually exclusive predicates'''
-        self.logger.info('mutex_filter_P: %s' % 
-                         set.intersection(set(P), set(mutexes)))
-        def cooc(I, p):
-            return sum( [self.scorer.pmi.F_ip(i,p) for i in I] )
-        P_ = [p for p in P
-              if cooc(I, p) > 3.0*cooc(p, mutexes)]
+        instances of mutually exclusive predicates. mutexes is a dictionary
+        mapping each mutually exclusive relation to its promoted
+        instances'''
+        M = set(tuple(i) for xs in mutexes.itervalues() for i in xs)
+        J = sorted(set(tuple(i) for i in I) | M)
+        index = {j:n for n,j in enumerate(J)}
+        mutexes = {rel:[tuple(i) for i in xs]
+                   for rel, xs in mutexes.iteritems()}
+        F = self.scorer.pmi.submatrix(J, P, 'F_ip').tocsr()
+        keep = self.mutex_rule(F, index, [tuple(i) for i in I], mutexes, 0,
+                               'mutex_filter_p')
+        P_ = [p for p, k in zip(P, keep) if k]
         self.logger.info('mutex_filter_p: %d => %d' % (len(P), len(P_)))
         return P_
 
-    def iterate_p(self, mutexes=[]):
+    def iterate_p(self, mutexes={}):
         '''perform an iteration of bootstrapping saving n patterns with the 
-        highest reliability score'''
+        highest reliability score, returning the patterns promoted in this
+        iteration'''
         if not getattr(self, 'connection', None):
             self.init_connection()
 
@@ -106,38 +194,50 @@ class CPLWorker(Bootstrapper):
 
         # read promoted instances of last bootstrpping iteration
         self.logger.info('getting promoted instances...''')
-        I = self.get_I(self.it-1)
+        with self.stage('p', 'get_I'):
+            I = self.state_I(self.it-1)
         self.logger.info('I: %d' % len(I))
         self.logger.info('getting promoted instances: done.''')
 
         # find matching patterns
         self.logger.info('getting matching patterns...')
-        P_ = self.I2P(I)
-        P = self.mutex_filter_p(I, P_, mutexes)
+        with self.stage('p', 'I2P'):
+            P_ = self.I2P(I)
+        self.cost = len(P_)
+        with self.stage('p', 'mutex'):
+            P = self.mutex_filter_p(I, P_, mutexes)
         self.logger.info('getting matching patterns: done.')
 
         # rank patterns by reliability score
         self.logger.info('ranking patterns ...')
-        rs = self.scorer.rank_patterns(I, P, self.it)
+        with self.stage('p', 'rank'):
+            rs = self.scorer.rank_patterns(I, P, self.it, self.n)
         self.logger.info('ranking patterns: done.')
 
         # save top n to <matrix>_boot_p
         self.logger.info('saving top %d patterns...' % self.n)
-        for r in rs[:self.n]:
+        for r in rs:
             self.logger.info('r: %s' % r)
-            mongodb.cache(self.db, self.boot_p, r)
+        with self.stage('p', 'snapshot'):
+            self.promote('p', rs)
+        with self.stage('p', 'save'):
+            self.save_P(rs)
         self.logger.info('saving top %d patterns: done.' % self.n)
 
         self.logger.info('ensuring indices ...')
-        # index for iteration number
-        self.db[self.boot_p].ensure_index( [('it', pymongo.DESCENDING), ] )
-        # index for <REL>
-        self.db[self.boot_p].ensure_index( [('rel', pymongo.ASCENDING), ] )
+        with self.stage('p', 'ensure_index'):
+            # index for iteration number
+            self.db[self.boot_p].ensure_index( [('it', pymongo.DESCENDING), ] )
+            # index for <REL>
+            self.db[self.boot_p].ensure_index( [('rel', pymongo.ASCENDING), ] )
         self.logger.info('ensuring indices: done.')
+        self.logger.info('PMI %s' % self.scorer.pmi.stats())
+        return self.state_P(self.it)
 
-    def iterate_i(self, mutexes=[]):
+    def iterate_i(self, mutexes={}):
         '''perform an iteration of bootstrapping saving n instances with the 
-        highest reliability score'''
+        highest reliability score, returning the instances promoted in this
+        iteration'''
         if not getattr(self, 'connection', None):
             self.init_connection()
 
@@ -146,69 +246,112 @@ class CPLWorker(Bootstrapper):
 
         # read promoted patterns of last bootstrpping iteration
         self.logger.info('getting promoted patterns...''')
-        P = self.get_P(self.it)
+        with self.stage('i', 'get_P'):
+            P = self.state_P(self.it)
         self.logger.info('P: %d' % len(P))
         self.logger.info('getting promoted patterns: done.''')
 
         # find matching instances
         self.logger.info('getting matching instances...')
-        I_ = self.P2I(P)
-        I = self.mutex_filter_i(I_, P, mutexes)
+        with self.stage('i', 'P2I'):
+            I_ = self.P2I(P)
+        self.cost = len(I_)
+        with self.stage('i', 'mutex'):
+            I = self.mutex_filter_i(I_, P, mutexes)
         self.logger.info('getting matching instances: done.')
 
         # rank instances by reliability score
         self.logger.info('ranking instances ...')
-        rs = self.scorer.rank_instances(I, P, self.it)
+        with self.stage('i', 'rank'):
+            rs = self.scorer.rank_instances(I, P, self.it, self.n)
         self.logger.info('ranking instances: done.')
 
         # save top n to <matrix>_boot_p
         self.logger.info('saving top %d instances...' % self.n)
-        for r in rs[:self.n]:
+        for r in rs:
             self.logger.info('r: %s' % r)
-            mongodb.cache(self.db, self.boot_i, r)
+        with self.stage('i', 'snapshot'):
+            self.promote('i', rs)
+        with self.stage('i', 'save'):
+            self.save_I(rs)
         self.logger.info('saving top %d instances: done.' % self.n)
 
         self.logger.info('ensuring indices ...')
-        # index for iteration number
-        self.db[self.boot_i].ensure_index( [('it', pymongo.DESCENDING), ] )
-        # index for <ARGJ,...,ARGN>
-        self.db[self.boot_i].ensure_index(
-            [(arg, pymongo.ASCENDING)
-             for arg in self.args]
-            )
+        with self.stage('i', 'ensure_index'):
+            # index for iteration number
+            self.db[self.boot_i].ensure_index( [('it', pymongo.DESCENDING), ] )
+            # index for <ARGJ,...,ARGN>
+            self.db[self.boot_i].ensure_index(
+                [(arg, pymongo.ASCENDING)
+                 for arg in self.args]
+                )
         self.logger.info('ensuring indices: done.')
+        self.logger.info('PMI %s' % self.scorer.pmi.stats())
+        return self.state_I(self.it)
 
 def get_scorer(scorer):
     scorers_ = dict(inspect.getmembers(scorers, inspect.isclass))
     return scorers_[scorer]
 
-def iterate_i(kwargs):
-    mutexes = kwargs.pop('mutexes', [])
-    #print >>sys.stderr, 'iterate_i:', len(kwargs), kwargs
-    cpl = CPLWorker(**kwargs)
-    cpl.iterate_i(mutexes)
-
-def iterate_p(kwargs):
-    mutexes = kwargs.pop('mutexes', [])
-    #print >>sys.stderr, 'iterate_p:', len(kwargs), kwargs
-    cpl = CPLWorker(**kwargs)
-    cpl.iterate_p(mutexes)
-
-def get_I(kwargs):
-    mutexes = kwargs.pop('mutexes', [])
-    #print >>sys.stderr, 'get_I:', len(kwargs), kwargs
-    cpl = CPLWorker(**kwargs)
-    I = cpl.get_I(cpl.it)
-    #print >>sys.stderr, 'get_I:', cpl.it, I
-    return I
-
-def get_P(kwargs):
-    mutexes = kwargs.pop('mutexes', [])
-    #print >>sys.stderr, 'get_P:', len(kwargs), kwargs
-    cpl = CPLWorker(**kwargs)
-    P = cpl.get_P(cpl.it)
-    #print >>sys.stderr, 'get_P:', cpl.it, P
-    return P
+def serve(n, commands, results):
+    '''runs CPLWorkers for the relations sent to worker n until it
+    receives None from commands, executing each (rel, kwargs, it, method,
+    args) command with the CPLWorker for rel, which is created from kwargs
+    the first time rel is sent, and putting (n, rel, it, method, result,
+    cost, records, error) on results, where cost is the number of
+    candidates the command considered and records are the timings of its
+    stages'''
+    cpls = {}
+    for rel, kwargs, it, method, args in iter(commands.get, None):
+        try:
+            if rel not in cpls:
+                cpls[rel] = CPLWorker(**kwargs)
+            cpl = cpls[rel]
+            cpl.it = it
+            cpl.cost = 0
+            r = getattr(cpl, method)(*args)
+            results.put((n, rel, it, method, r, cpl.cost, cpl.stats.take(),
+                         None))
+        except Exception:
+            results.put((n, rel, it, method, None, 0, [],
+                         traceback.format_exc()))
+
+
+class CPLProcess:
+    '''a long-lived process that keeps a CPLWorker for each relation it
+    has been sent, along with its connection, PMI look ups, and caches,
+    across iterations'''
+    def __init__(self, n, results):
+        self.n = n
+        self.rels = set()
+        self.commands = multiprocessing.Queue()
+        self.process = multiprocessing.Process(
+            target=serve, args=(n, self.commands, results)
+            )
+        self.process.daemon = True
+        self.process.start()
+
+    def send(self, rel, kwargs, it, method, *args):
+        '''asks the worker to call method(*args) at iteration it on the
+        CPLWorker for rel, creating it from kwargs if the worker does not
+        have one yet'''
+        if rel in self.rels:
+            kwargs = None
+        self.rels.add(rel)
+        self.commands.put((rel, kwargs, it, method, args))
+
+    def stop(self):
+        '''asks the worker to exit once it has finished its current task'''
+        self.commands.put(None)
+
+    def join(self, timeout=STOP_TIMEOUT):
+        '''waits up to timeout seconds for the worker to exit, terminating
+        it if it is still running'''
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+
 
 class CPLManager:
     def __init__(self, config):
@@ -220,7 +363,29 @@ class CPLManager:
         self.keep = config.getboolean('boot', 'keep')
         self.reset = config.getboolean('boot', 'reset')
         self.n = config.getint('boot', 'n')
+        self.cache_size = 100000
+        if config.has_option('boot', 'cache_size'):
+            self.cache_size = config.getint('boot', 'cache_size')
+        self.cache_policy = 'lru'
+        if config.has_option('boot', 'cache_policy'):
+            self.cache_policy = config.get('boot', 'cache_policy')
+        self.engine = 'mongo'
+        if config.has_option('boot', 'engine'):
+            self.engine = config.get('boot', 'engine')
+        self.artifact = None
+        if config.has_option('boot', 'artifact'):
+            self.artifact = config.get('boot', 'artifact')
+        self.tmp_artifact = False
+        self.report = None
+        if config.has_option('boot', 'report'):
+            self.report = config.get('boot', 'report')
+        self.stats = instrument.Instrument('cpl', self.report)
         self.rels = config._sections['general']['rels'].split(',')
+        self.workers = min(len(self.rels), multiprocessing.cpu_count())
+        if config.has_option('boot', 'workers'):
+            self.workers = config.getint('boot', 'workers')
+        if self.workers < 1:
+            raise ValueError('CPL needs at least 1 worker: %d' % self.workers)
         self.mutex = {rel:mutex.split(',')
                       for rel, mutex in config._sections['mutex'].items()
                       if rel != '__name__'}
@@ -234,14 +399,14 @@ class CPLManager:
         #self.logger.setLevel(logging.WARNING)
 
     def make_mutexes(self, rel, mutex_dict):
-        mutexes = set()
-        for ms in self.mutex[rel]:
-            for m in mutex_dict[ms]:
-                mutexes.add(m)
-        return sorted(mutexes)
-
-    def make_cpl_args(self, it, mutexes=None):
-        def make_args(rel, it, mutexes=None):
+        '''returns a dictionary mapping each relation that is mutually
+        exclusive with rel to its items in mutex_dict'''
+        return {ms:mutex_dict[ms] for ms in self.mutex[rel]}
+
+    def make_cpl_args(self, it):
+        '''returns a dictionary mapping each relation to the arguments of
+        its CPLWorker'''
+        def make_args(rel, it):
             args = {
                 'host': self.host,
                 'port': self.port,
@@ -253,48 +418,188 @@ class CPLManager:
                 'keep': self.keep,
                 'scorer': self.scorer,
                 'it': it,
+                'cache_size': self.cache_size,
+                'cache_policy': self.cache_policy,
+                'engine': self.engine,
+                'artifact': self.artifact,
              }
             if it == 0:
                 args['reset'] = self.reset
             else:
                 args['reset'] = False
-            if mutexes: args['mutexes'] = mutexes
             return args
-        cpl_args = [make_args(rel, it, mutexes)
-                    for rel in self.rels]
+        cpl_args = {rel:make_args(rel, it)
+                    for rel in self.rels}
         return cpl_args
 
+    def publish(self):
+        '''saves the matrix and its scores once as an artifact that all
+        workers of the memory engine memory map, unless the configured
+        artifact already exists'''
+        if self.engine != 'memory':
+            return
+        if self.artifact and os.path.isdir(self.artifact):
+            self.logger.info('using artifact %s' % self.artifact)
+            return
+        if not self.artifact:
+            self.artifact = tempfile.mkdtemp(prefix='%s_' % self.matrix)
+            self.tmp_artifact = True
+        import memory_pmi
+        self.logger.info('publishing %s to %s ...' % 
+                         (self.matrix, self.artifact))
+        connection = pymongo.Connection(self.host, self.port)
+        memory_pmi.publish(PMI(connection[self.db], self.matrix),
+                           self.artifact)
+        connection.disconnect()
+        self.logger.info('publishing %s to %s: done.' % 
+                         (self.matrix, self.artifact))
+
+    def unpublish(self):
+        '''removes the artifact if it was created by publish'''
+        if self.tmp_artifact:
+            shutil.rmtree(self.artifact)
+            self.artifact = None
+            self.tmp_artifact = False
+
+    def start_workers(self):
+        '''starts self.workers CPLProcess workers'''
+        self.results = multiprocessing.Queue()
+        self.pool = [CPLProcess(n, self.results)
+                     for n in xrange(self.workers)]
+        self.idle = list(self.pool)
+        self.cpl_args = self.make_cpl_args(0)
+        self.created = set()
+
+    def stop_workers(self):
+        '''stops all CPLProcess workers. idle workers are given
+        STOP_TIMEOUT seconds to exit, while workers still busy with a task,
+        which only happens after a failure, are terminated'''
+        try:
+            for w in self.pool:
+                w.stop()
+        finally:
+            for w in self.pool:
+                w.join(STOP_TIMEOUT if w in self.idle else 0)
+            self.pool = []
+
+    def dispatch(self, cost, rel, it, method, *args):
+        '''sends a task to an idle worker, preferring one that already
+        hosts rel. the CPLWorker for each relation is reset only the first
+        time it is created'''
+        hosts = [w for w in self.idle if rel in w.rels]
+        w = hosts[0] if hosts else self.idle[0]
+        self.idle.remove(w)
+        kwargs = self.cpl_args[rel]
+        if rel in self.created:
+            kwargs = dict(kwargs, reset=False)
+        self.created.add(rel)
+        self.logger.debug('dispatch: %s %d %s (cost %s) to worker %d' % 
+                          (rel, it, method, cost, w.n))
+        w.send(rel, kwargs, it, method, *args)
+
+    def receive(self):
+        '''waits for a worker to finish a task, adding the timings of its
+        stages to the report and returning (rel, it, method, result,
+        cost). every POLL_INTERVAL seconds without a result, the workers
+        running a task are checked, raising RuntimeError if one of them
+        has exited (e.g. killed for running out of memory) instead of
+        waiting for a result that will never come'''
+        while True:
+            busy = [w for w in self.pool if w not in self.idle]
+            if not busy:
+                raise RuntimeError('no CPL worker is running a task')
+            # a worker that exited before the wait has already sent any
+            # result it had, so none arriving during the wait means it died
+            # without one
+            dead = [w for w in busy if not w.process.is_alive()]
+            try:
+                result = self.results.get(timeout=POLL_INTERVAL)
+                break
+            except Queue.Empty:
+                if dead:
+                    w = dead[0]
+                    raise RuntimeError('CPL worker %d exited with code %s '
+                                       'while running a task' % 
+                                       (w.n, w.process.exitcode))
+        n, rel, it, method, r, cost, records, error = result
+        self.idle.append(self.pool[n])
+        for record in records:
+            self.stats.add(record)
+        if error:
+            raise RuntimeError('CPL worker %d failed on %s %s %d:\n%s' % 
+                               (n, rel, method, it, error))
+        return rel, it, method, r, cost
+
     def bootstrap(self, start, stop):
-        pool = multiprocessing.Pool(processes=len(self.rels))
-        cpl_args = self.make_cpl_args(0)
-        self.logger.debug('cpl_args: %s' % cpl_args)
-        Is = {rel:I
-              for rel,I in zip(self.rels, 
-                               pool.map(get_I, cpl_args))}
-        self.logger.debug('pool_map_Is %s:' % Is)
-        mutex_Is = {rel:self.make_mutexes(rel, Is)
-                    for rel in self.rels}
-        self.logger.debug('mutex_Is: %s' % mutex_Is)
-        for it in xrange(start, stop+1):
-            self.logger.debug('ITERATION %d:' % it)
-            cpl_args = self.make_cpl_args(it, mutex_Is)
-            pool.map(iterate_p, cpl_args)
-            Ps = {rel:P 
-                  for rel,P in zip(self.rels, 
-                                   pool.map(get_P, cpl_args))}
-            self.logger.debug('pool_map_Ps: %s' % Ps)
-            mutex_Ps = {rel:self.make_mutexes(rel, Ps)
-                        for rel in self.rels}
-            self.logger.debug('mutex_Ps: %s' % mutex_Ps)
-            cpl_args = self.make_cpl_args(it, mutex_Ps)
-            pool.map(iterate_i, cpl_args)
-            Is = {rel:I
-                  for rel,I in zip(self.rels, 
-                                   pool.map(get_I, cpl_args))}
-            self.logger.debug('pool_map_Is: %s' % Is)
-            mutex_Is = {rel:self.make_mutexes(rel, Is)
-                        for rel in self.rels}
-            self.logger.debug('mutex_Is: %s' % mutex_Is)
+        '''bootstraps all relations from iteration start to stop. tasks
+        are run on self.workers processes, most expensive first, and each
+        relation moves on as soon as the relations it is mutually
+        exclusive with have promoted the items it needs'''
+        self.publish()
+        self.start_workers()
+        try:
+            self.schedule(start, stop)
+        finally:
+            try:
+                self.stop_workers()
+            finally:
+                self.unpublish()
+        self.stats.print_summary()
+
+    def schedule(self, start, stop):
+        '''runs the tasks of every relation from iteration start to stop.
+        iterate_p at iteration it waits for the promoted instances of the
+        relation and its mutex relations from iteration it-1, and
+        iterate_i waits for their promoted patterns from iteration it.
+        promoted items are returned by the iterations that promote them, so
+        only the instances promoted before start are looked up'''
+        Is = defaultdict(dict)
+        Ps = defaultdict(dict)
+        costs = {('p', rel):len(self.seeds[rel]) for rel in self.rels}
+        costs.update({('i', rel):len(self.seeds[rel]) for rel in self.rels})
+        unknown = set(m for rel in self.rels for m in self.mutex[rel]
+                      if m not in self.rels)
+        if unknown:
+            raise ValueError('unknown mutex relations: %s' % sorted(unknown))
+        ready = []
+        def push(phase, rel, it, method, *args):
+            # look ups of promoted instances unblock all tasks and run first
+            cost = costs[(phase, rel)] if phase else float('inf')
+            heapq.heappush(ready, (-cost, it, rel, method, args))
+        def waiting(rel, Xs, it):
+            return any(m not in Xs[it] for m in [rel] + self.mutex[rel])
+        def dependents(rel):
+            return [r for r in self.rels if r == rel or rel in self.mutex[r]]
+        # instances promoted before iteration start
+        for rel in self.rels:
+            push(None, rel, start-1, 'state_I', start-1)
+        running = 0
+        while ready or running:
+            while ready and self.idle:
+                cost, it, rel, method, args = heapq.heappop(ready)
+                self.dispatch(-cost, rel, it, method, *args)
+                running += 1
+            rel, it, method, r, cost = self.receive()
+            running -= 1
+            if method == 'iterate_p':
+                costs[('p', rel)] = cost
+                Ps[it][rel] = r
+                self.logger.debug('Ps %d %s: %s' % (it, rel, r))
+                for d in dependents(rel):
+                    if not waiting(d, Ps, it):
+                        push('i', d, it, 'iterate_i',
+                             self.make_mutexes(d, Ps[it]))
+            else:
+                if method == 'iterate_i':
+                    costs[('i', rel)] = cost
+                Is[it][rel] = r
+                self.logger.debug('Is %d %s: %s' % (it, rel, r))
+                if it+1 > stop:
+                    continue
+                for d in dependents(rel):
+                    if not waiting(d, Is, it):
+                        push('p', d, it+1, 'iterate_p',
+                             self.make_mutexes(d, Is[it]))
 
 def main():
     from optparse import OptionParser
@@ -17,14 +17,30 @@
           -s START, --start=START
                                 iteration to start with. default: 1
           -t STOP, --stop=STOP  iteration to stop at. default: 2
+          --cache-size=CACHE_SIZE
+                                number of PMI and frequency look ups to cache
+                                in memory. 0 disables caching. default: 100000
+          --cache-policy=CACHE_POLICY
+                                cache eviction policy: lru or fifo. default: lru
+          --engine=ENGINE       look up PMI scores and candidates in mongodb
+                                (mongo) or in the matrix loaded into memory
+                                (memory). default: mongo
+          --artifact=ARTIFACT   with the memory engine, memory map the matrix
+                                from a directory saved by matrix2pmi.py
+                                --backend=sparse instead of loading it from
+                                mongodb
+          --report=REPORT       append the wall time, mongodb calls, and
+                                documents returned by each stage of each
+                                iteration to REPORT as JSON lines
 
 ### Caches Created
 
-Creates 2 caches of bootstrapped instances and patterns for the target 
+Creates 3 caches of bootstrapped instances and patterns for the target 
 relation:
 
 1. `<matrix>_<rel>_esp_i`: bootstrapped instances for <rel>
 2. `<matrix>_<rel>_esp_p`: bootstrapped patterns for <rel>
+3. `<matrix>_<rel>_esp_s`: snapshots of each iteration for <rel>
 
 ### Bootstrapping
 
@@ -36,6 +52,45 @@ patterns and instances following the Espresso bootstrapping algorithm [1].
 3. keep top 10 promoted instances/patterns
 4. bootstrap patterns/instances using promoted instances/patterns
 
+### Snapshots
+
+After each pattern and instance phase of an iteration, the instances
+or patterns it promoted with the iteration they were promoted in and
+their reliability scores are saved as one compressed document to
+`<matrix>_<rel>_esp_s`, before the items promoted in the phase are
+saved, so each snapshot only holds what its phase added. An iteration
+rebuilds the state after the phase before it from the snapshots up to
+that phase in one query, unless it is still held from the previous
+phase, and the promoted items and their scores are then looked up in
+memory. A run resumed or extended with `--start K` continues from the
+snapshots up to iteration K-1 without rereading the promoted instances
+and patterns, which are only read from their collections when there is
+no snapshot or a snapshot is missing, as for results bootstrapped
+before snapshots were saved, and are then saved whole as the snapshot
+of that phase.
+
+### Instrumentation
+
+Each stage of each iteration (getting the promoted instances or
+patterns, I2P/P2I, ranking, saving, the snapshot, and ensuring
+indices) records its wall time, the number of mongodb calls it made,
+and the number of documents returned to it (see `instrument.py`). A
+table of the totals by stage and by iteration is printed when
+bootstrapping finishes, and `--report` appends one JSON line per stage
+to a file.
+
+### In-Memory Engine
+
+With `--engine memory`, the matrix and its scores are loaded into
+memory once before the first iteration (see `memory_pmi.py`), and
+candidate retrieval and scoring run without matrix or PMI look ups. Only the
+promoted instances and patterns are written to mongodb. It requires
+numpy and scipy.
+
+With `--artifact`, the matrix is instead memory mapped read-only from
+the arrays saved by `matrix2pmi.py --backend sparse --artifact`, so
+that processes bootstrapping the same matrix share one copy of it.
+
 ### Reliability Score
 
 Candidate patterns and instances are ranked by reliability score, which 
@@ -51,6 +106,10 @@ pattern/instance and the set of instances/patterns that generated it.
 where dpmi is Discounted Pointwise Mutual Information [2].
 r_i and r_p are recursively defined with r_i=1.0 for the seed instances.
 
+`--scorer=SparseReliabilityScorer` calculates the same scores as sparse
+matrix-vector products over the dpmi submatrix of the candidates, which
+is retrieved once per iteration. It requires numpy and scipy.
+
 ### References
 
 [1] Patrick Pantel and Marco Pennacchiotti.
@@ -70,7 +129,8 @@ import scorers
 class Espresso(Bootstrapper):
     __short__ = 'esp'
     def __init__(self, host, port, db, matrix, rel, seeds, n, keep, reset,
-                 scorer, it=1):
+                 scorer, it=1, cache_size=100000, cache_policy='lru',
+                 engine='mongo', artifact=None, report=None):
         #logging.basicConfig()
         self.logger = logging.getLogger('Espresso')
         self.logger.setLevel(logging.INFO)
@@ -84,7 +144,8 @@ class Espresso(Bootstrapper):
             self.logger.addHandler(handler)
         Bootstrapper.__init__(
             self, host, port, db, matrix, rel, 
-            seeds, n, keep, reset, scorer, it
+            seeds, n, keep, reset, scorer, it, cache_size, cache_policy,
+            engine, artifact, report
             )
 
 def main():
@@ -111,6 +172,19 @@ def main():
                       help='''iteration to start with. default: 1''')
     parser.add_option('-t', '--stop', dest='stop', type=int, default=10,
                       help='''iteration to stop at. default: 10''')
+    parser.add_option('--cache-size', dest='cache_size', type=int,
+                      default=100000,
+                      help='''number of PMI and frequency look ups to cache in memory. 0 disables caching. default: 100000''')
+    parser.add_option('--cache-policy', dest='cache_policy',
+                      choices=['lru', 'fifo'], default='lru',
+                      help='''cache eviction policy: lru or fifo. default: lru''')
+    parser.add_option('--engine', dest='engine',
+                      choices=['mongo', 'memory'], default='mongo',
+                      help='''look up PMI scores and candidates in mongodb (mongo) or in the matrix loaded into memory (memory). default: mongo''')
+    parser.add_option('--artifact', dest='artifact', default=None,
+                      help='''with the memory engine, memory map the matrix from a directory saved by matrix2pmi.py --backend=sparse instead of loading it from mongodb''')
+    parser.add_option('--report', dest='report', default=None,
+                      help='''append the wall time, mongodb calls, and documents returned by each stage of each iteration to REPORT as JSON lines''')
     options, args = parser.parse_args()
     if len(args) < 3:
         parser.print_help()
@@ -121,7 +195,8 @@ def main():
     scorer = scorers_[options.scorer]
     e = Espresso(options.host, options.port, db, matrix, rel, seeds, 
                  options.n, options.keep, options.reset, scorer, 
-                 options.start)
+                 options.start, options.cache_size, options.cache_policy,
+                 options.engine, options.artifact, options.report)
     e.bootstrap(options.start, options.stop)
 
 if __name__ == '__main__':
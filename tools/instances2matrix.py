@@ -20,6 +20,31 @@ relation pattern * arguments in mongodb from input instances
   			      default: localhost
   	-p PORT, --port=PORT  mongodb host machine port number. 
   			      default: 27017
+  	-r, --reset           reset matrix collections. default: False
+  	-b BATCH, --batch-size=BATCH
+  			      number of instances per batched insert.
+  			      default: 1000
+  	-w W, --write-concern=W
+  			      write concern for batched inserts. default: 1
+  	-j, --journal         wait for batched inserts to be journaled.
+  			      default: False
+  	-a CAPACITY, --aggregate=CAPACITY
+  			      number of unique (rel,args) tuples to sum in
+  			      memory before spilling to disk. 0 disables
+  			      aggregation. default: 1000000
+  	--tmpdir=TMPDIR       directory for spilled aggregation runs.
+  			      default: system temp dir
+  	--workers=WORKERS     number of worker processes to ingest input
+  			      files with. default: 1
+  	-f FORMAT, --format=FORMAT
+  			      input format: instances or reverb
+  			      extractions. default: instances
+  	--checkpoint=EVERY    number of instances read or documents
+  			      written between ingest checkpoints. 0
+  			      disables checkpoints. default: 1000000
+  	-e, --encode          store integer ids of rel and arg strings from
+  			      the <collection>_vocab vocabulary.
+  			      default: False
 
 ### Instances
 
@@ -36,6 +61,12 @@ Instances have the following tab-delimited format:
 #### Example
 
     1.0\treverb_clueweb_tuples-1.1.txt:30:10-11\tARG1 acquired ARG2\t2\Google\tYouTube
+
+#### Input Files
+
+Input files ending in `.gz`, `.bz2`, or `.xz` are decompressed as a
+stream. With `--format reverb`, ReVerb extractions are converted to
+instances as they are read, as `reverb_clueweb2instances.sh` does.
      
 ### Co-occurence Matrix
 
@@ -49,6 +80,15 @@ The co-occurence matrix collection has the following fields:
 * `argn`: nth argument
 * `score`: score for rel * args tuple
 
+Instances with the same rel * args tuple are summed into a single
+document during ingest, holding a bounded number of tuples in memory
+and spilling sorted runs to disk when it fills. Tuples are summed over
+all input files of an ingest: each file (or shard of `--workers`) is
+read into spilled runs, and the runs of all of them are merged and
+written once every file has been read. A later ingest of other files
+into the same matrix adds its own documents, which PMI calculation sums
+with the existing ones.
+
 #### Naming Scheme
 
 Instances of differing argument count are stored in separate mongodb
@@ -60,22 +100,71 @@ collection `clueweb` has instances with argument counts of 1, 2, and
 * `clueweb_2`
 * `clueweb_3`
  
+#### Vocabulary
+
+With `--encode`, `rel` and `argN` store integer ids of their strings
+from the `<collection>_vocab` vocabulary (see `vocab.py`) instead of
+the strings themselves.
+
+#### Checkpoints
+
+Ingest progress is committed to `<collection>_ingest` every
+`--checkpoint` instances as the offset of the last line read and the
+number of documents written for each input file (or shard). Rerunning
+the same command after a failure resumes each file from its last
+checkpoint, and files that finished are skipped. Documents carry an
+`_id` derived from their shard and position in the input, so documents
+written after the last checkpoint are not duplicated when they are
+written again. Checkpoints belong to the ingest of a list of files, so
+other files can still be appended to the matrix later, and rerunning an
+ingest that finished is skipped. The shards and whether instances are
+aggregated are recorded as well, and resuming an unfinished ingest with
+different `--workers` or `--aggregate` is refused.
+
+When instances are aggregated, the runs of summed tuples spilled so far
+are committed with each checkpoint and kept in
+`<tmpdir>/<collection>_ingest_<key>` until the ingest finishes, so an
+interrupted file resumes reading from its last checkpoint. The summed
+tuples are written once all files have been read, committing the
+number of documents written every `--checkpoint` documents. If the
+spilled runs of a file have been removed, it is read again from its
+start.
+
 #### Indexing
 
-It is indexed for fast look up of rel, args, and (rel,args) tuples.
+It is indexed for fast look up of rel, args, and (rel,args) tuples
+with a <REL,ARG1,...,ARGN> and an <ARG1,...,ARGN> index, the only
+indices queried by PMI calculation and bootstrapping. Indices are
+built in the background after all instances are loaded, and the build
+time and size of each index are reported.
 '''
 
-import fileinput
+import bz2
 import functools
+import gzip
+import hashlib
+import io
+import itertools
+import multiprocessing
+import os
 import pymongo
 import re
+import shutil
+import subprocess
 import sys
-from collections import namedtuple
+import tempfile
+import time
+from collections import deque, namedtuple
 
 import mongodb
+from aggregator import Aggregator
+from vocab import Vocabulary, vocab_name
 
 Instance = namedtuple('Instance', ['score', 'loc', 'rel', 'argc', 'argv'])
 
+BUFFER_SIZE = 16 * 1024 * 1024
+COMPRESSED = ('.gz', '.bz2', '.xz')
+
 def str2instance(s):
     '''converts tab-delimited string into Instance'''
     ss = s.strip().split('\t')
@@ -86,6 +175,87 @@ def str2instance(s):
     assert len(argv) == argc
     return Instance(score, loc, rel, argc, argv)
 
+def reverb2instance(s, source):
+    '''converts a tab-delimited ReVerb extraction into an Instance with a
+    score of 1.0 and its source file as loc, following
+    reverb_clueweb2instances.sh. returns None for lines with fewer than
+    4 fields, which are logged and skipped'''
+    ss = s.rstrip('\r\n').split('\t', 5)
+    if len(ss) < 4:
+        print >>sys.stderr, '%s: skipping malformed line: %r' % (source, s)
+        return None
+    arg1, rel, arg2 = ss[1:4]
+    return Instance(1.0, source, rel, 2, [arg1, arg2])
+
+def make_parser(f, format='instances'):
+    '''returns a function converting lines of f in format into Instances'''
+    if format == 'reverb':
+        source = os.path.basename(f)
+        return lambda s: reverb2instance(s, source)
+    return str2instance
+
+def is_compressed(f):
+    '''returns true if f is a gzip, bz2, or xz file'''
+    return f.endswith(COMPRESSED)
+
+class XZFile:
+    '''reads the output of xz -dc f, raising IOError on close if xz failed,
+    so that truncated or corrupt files are not read as short input'''
+    def __init__(self, f, buffering=BUFFER_SIZE):
+        self.name = f
+        self.process = subprocess.Popen(['xz', '-dc', f],
+                                        stdout=subprocess.PIPE,
+                                        bufsize=buffering)
+        self.eof = False
+
+    def __iter__(self):
+        for line in self.process.stdout:
+            yield line
+        self.eof = True
+
+    def close(self):
+        '''closes the stream and waits for xz. xz is killed if the stream
+        is closed before it was read to the end'''
+        if self.process.returncode is not None:
+            return
+        if not self.eof:
+            self.process.kill()
+        self.process.stdout.close()
+        code = self.process.wait()
+        if self.eof and code != 0:
+            raise IOError('xz -dc %s exited with status %d' %
+                          (self.name, code))
+
+def open_input(f, buffering=BUFFER_SIZE):
+    '''opens f for reading with a read buffer of size buffering,
+    decompressing gzip, bz2, and xz files as a stream. f of '-' reads
+    from stdin'''
+    if f == '-':
+        return sys.stdin
+    if f.endswith('.gz'):
+        return io.BufferedReader(gzip.open(f, 'rb'), buffering)
+    if f.endswith('.bz2'):
+        return bz2.BZ2File(f, 'r', buffering)
+    if f.endswith('.xz'):
+        # python 2 has no lzma module, so stream through xz instead
+        return XZFile(f, buffering)
+    return io.open(f, 'rb', buffering)
+
+def read_instances(files, format='instances', buffering=BUFFER_SIZE):
+    '''yields Instances from each line of files in format, reading from
+    stdin if files is empty'''
+    for f in files or ['-']:
+        parse = make_parser(f, format)
+        xs = open_input(f, buffering)
+        try:
+            for line in xs:
+                i = parse(line)
+                if i is not None:
+                    yield i
+        finally:
+            if xs is not sys.stdin:
+                xs.close()
+
 def instance2doc(i):
     '''converts Instance into mongodb document (i.e. dictionary), enumerating all 
     args in argv'''
@@ -95,6 +265,26 @@ def instance2doc(i):
     doc['rel'] = i.rel
     return doc
 
+def instance_key(i):
+    '''returns the key instances with the same (rel, args) tuple as i are
+    summed under'''
+    return (i.argc, i.rel) + tuple(i.argv)
+
+def aggregated_instances(aggregator):
+    '''yields one Instance per (rel, args) tuple summed by aggregator'''
+    for key, score in aggregator.items():
+        argc, rel = key[:2]
+        yield Instance(score, None, rel, argc, list(key[2:]))
+
+def aggregate_instances(instances, capacity=1000000, tmpdir=None):
+    '''sums the scores of instances sharing a (rel, args) tuple, holding at
+    most capacity tuples in memory, and yields one Instance per tuple'''
+    aggregator = Aggregator(capacity, tmpdir)
+    for i in instances:
+        aggregator.add(instance_key(i), i.score)
+    for i in aggregated_instances(aggregator):
+        yield i
+
 def collection2argc(c):
     '''splits collection name into baseform and argc'''
     return int(c.split('_')[-1])
@@ -109,27 +299,36 @@ def get_matrix_collections(db, matrix):
             for c in db.collection_names()
             if is_matrix_collection(matrix, c)]
 
-def ensure_indices(db, coll):
+def index_plan(n):
+    '''returns the indices queried by PMI and bootstrapping for a
+    collection with n arguments: <REL,ARG1,...,ARGN> for look up by
+    pattern or (pattern, instance) and <ARG1,...,ARGN> for look up by
+    instance'''
+    args = [('arg%d'%i, pymongo.ASCENDING)
+            for i in xrange(1, n+1)]
+    return [[('rel', pymongo.ASCENDING), ] + args, args]
+
+def ensure_indices(db, coll, background=True):
+    '''builds the indices in index_plan() for coll in the background,
+    reporting the time taken to build them and their size'''
     x = db[coll].find_one()
+    if not x:
+        return
     n = len( [k 
               for k in x.keys()
               if k.startswith('arg')] )
-    # index for <REL,ARG1,...ARGN>
-    db[coll].ensure_index(
-        [('rel', pymongo.ASCENDING), ] + \
-            [('arg%d'%i, pymongo.ASCENDING)
-             for i in xrange(1, n+1)]
-        )
-    for i in xrange(1, n+1):
-        # index for <ARGJ,...,ARGN>
-        db[coll].ensure_index(
-            [('arg%d'%j, pymongo.ASCENDING)
-             for j in xrange(i, n+1)]
-            )
+    for keys in index_plan(n):
+        start = time.time()
+        name = db[coll].create_index(keys, background=background)
+        print >>sys.stderr, '%s: built index %s in %.1fs' % \
+            (coll, name, time.time() - start)
+    sizes = db.command('collstats', coll).get('indexSizes', {})
+    for name, size in sorted(sizes.items()):
+        print >>sys.stderr, '%s: index %s: %d bytes' % (coll, name, size)
 
 def ensure_matrix_indices(db, matrix):
     '''ensures indices exist on collection for <REL,ARG1,...ARGN> and 
-    <ARG1,...,ARGN>, <ARG2,...,ARGN>, ..., <ARGN>'''
+    <ARG1,...,ARGN>'''
     print >>sys.stderr, 'ensuring indices for %s ...' % matrix
     for c in get_matrix_collections(db, matrix):
         ensure_indices(db, c)
@@ -139,20 +338,450 @@ def collection_argc(c, argc):
     '''returns collection name appended with _argc'''
     return '%s_%d' % (c, argc)
 
-def create_collection(db, collection, data):
-    '''creates collection containing instances from input files'''
-    for a in data:
-        i = str2instance(a)
-        #print >>sys.stderr, i
+def encode_instances(vocab, instances, batch=1000):
+    '''yields instances with rel and args replaced by their ids in vocab,
+    encoding batch instances at a time'''
+    instances = iter(instances)
+    while True:
+        chunk = list(itertools.islice(instances, batch))
+        if not chunk:
+            return
+        ids = vocab.encode_many([s 
+                                 for i in chunk
+                                 for s in [i.rel] + list(i.argv)])
+        for i in chunk:
+            yield i._replace(rel=ids[i.rel], argv=[ids[a] for a in i.argv])
+
+def save_instances(writer, collection, instances, capacity=1000000,
+                   tmpdir=None, ids=None, vocab=None):
+    '''writes instances to writer, summing instances with the same (rel,
+    args) tuple unless capacity is 0. documents take their _id from ids if
+    it is given, and store ids from vocab instead of strings if it is
+    given'''
+    if capacity:
+        instances = aggregate_instances(instances, capacity, tmpdir)
+    if vocab:
+        instances = encode_instances(vocab, instances, writer.batch)
+    for i in instances:
         d = instance2doc(i)
+        if ids:
+            d['_id'] = next(ids)
         c = collection_argc(collection, i.argc)
-        print >>sys.stderr, db[c], i
-        db[c].save(d, j=True)
+        writer.insert(c, d)
+
+def create_collection(db, collection, instances, batch=1000, wc=None,
+                      capacity=1000000, tmpdir=None, index=True,
+                      label='instances read', encode=False):
+    '''creates collection containing instances read from input, writing
+    them as unordered batches of size batch with write concern wc.
+    instances with the same (rel, args) tuple are summed into a single
+    document unless capacity is 0. if encode is true, strings are
+    stored as ids from the vocabulary of collection. returns the number
+    of documents written'''
+    writer = mongodb.BulkWriter(db, batch, wc)
+    vocab = Vocabulary(db, collection) if encode else None
+    progress = mongodb.Throughput(label)
+    def read(instances):
+        for i in instances:
+            progress.update()
+            yield i
+    save_instances(writer, collection, read(instances), capacity, tmpdir,
+                   vocab=vocab)
+    writer.flush()
+    progress.report()
+    print >>sys.stderr, '# %10d documents saved' % writer.written
     # ensure indices exist
-    ensure_matrix_indices(db, collection)
+    if index:
+        ensure_matrix_indices(db, collection)
+    return writer.written
 
-def reset_matrix(db, matrix):
-    for c in get_matrix_collections(db, matrix):
+def make_shards(files, workers):
+    '''returns a list of (file, start, end) byte ranges covering files,
+    splitting uncompressed files into ranges when there are fewer files
+    than workers. compressed files cannot be split and are read whole,
+    with an end of None'''
+    k = max(1, -(-workers // len(files)))
+    shards = []
+    for f in files:
+        if is_compressed(f):
+            shards.append((f, 0, None))
+            continue
+        size = os.path.getsize(f)
+        step = max(1, -(-size // k))
+        shards.extend((f, start, min(start+step, size))
+                      for start in xrange(0, size, step))
+    return shards
+
+def read_shard(f, start, end, format='instances', offset=0,
+               buffering=BUFFER_SIZE):
+    '''yields (offset, Instance) for the lines of f in format that begin
+    in the byte range [start, end), or for all of f if end is None, where
+    offset is the position following the line. lines ending at or before
+    offset are skipped'''
+    parse = make_parser(f, format)
+    if end is None:
+        xs = open_input(f, buffering)
+        position = 0
+        try:
+            for line in xs:
+                position += len(line)
+                if position > offset:
+                    i = parse(line)
+                    if i is not None:
+                        yield position, i
+        finally:
+            if xs is not sys.stdin:
+                xs.close()
+        return
+    with io.open(f, 'rb', buffering) as xs:
+        if offset > start:
+            xs.seek(offset)
+        elif start > 0:
+            # skip the line that straddles start; it belongs to the
+            # previous shard
+            xs.seek(start-1)
+            xs.readline()
+        while xs.tell() < end:
+            line = xs.readline()
+            if not line:
+                break
+            i = parse(line)
+            if i is not None:
+                yield xs.tell(), i
+
+def ingest_key(files, format='instances'):
+    '''returns a key identifying an ingest of files in format'''
+    s = '\n'.join([format] + [os.path.abspath(f) for f in files])
+    return hashlib.md5(s).hexdigest()[:16]
+
+def start_ingest(db, matrix, files, shards, capacity, format='instances'):
+    '''records an ingest of files into matrix with checkpoints in
+    <matrix>_ingest, returning its key, or None if the same files have
+    already been ingested. ingests of other files are independent, so
+    that files can be appended to a matrix. raises ValueError if an
+    unfinished ingest of the same files used different shards or
+    aggregation, as its checkpoints and document _ids would not match'''
+    coll = '%s_ingest' % matrix
+    key = ingest_key(files, format)
+    layout = {'shards': [list(x) for x in shards],
+              'aggregate': bool(capacity)}
+    doc = db[coll].find_one({'_id': key})
+    if doc is None:
+        db[coll].insert(dict(layout, _id=key,
+                             files=[os.path.abspath(f) for f in files],
+                             format=format, done=False))
+        return key
+    if doc['done']:
+        print >>sys.stderr, '%s: already ingested into %s' % \
+            (', '.join(files), matrix)
+        return None
+    if any(doc[k] != v for k, v in layout.items()):
+        raise ValueError('%s is being ingested into %s with different '
+                         'shards or aggregation (%s %s); resume with the '
+                         'same --workers and --aggregate or with --reset' % 
+                         (', '.join(files), matrix, coll, key))
+    return key
+
+def finish_ingest(db, matrix, key, tmpdir=None):
+    '''marks the ingest key of matrix as finished and removes its run
+    directory in tmpdir'''
+    db['%s_ingest' % matrix].update({'_id': key}, {'$set': {'done': True}},
+                                    j=True)
+    shutil.rmtree(run_dir(tmpdir, matrix, key), ignore_errors=True)
+
+def line_ids(key, offsets):
+    '''yields the _ids of the documents of instances of the shard key that
+    are not aggregated from the offsets of their lines, which are taken
+    from the deque offsets in the order the instances are read'''
+    while True:
+        yield '%s:%d' % (key, offsets.popleft())
+
+def shard_key(ingest, shard):
+    '''returns the checkpoint key of shard in the ingest key'''
+    return '%s/%s:%s-%s' % ((ingest, ) + tuple(shard))
+
+def run_dir(tmpdir, matrix, ingest):
+    '''returns the directory in tmpdir that holds the spilled aggregation
+    runs of the ingest key of matrix until the ingest finishes'''
+    return os.path.join(tmpdir or tempfile.gettempdir(),
+                        '%s_ingest_%s' % (matrix, ingest))
+
+class Checkpoint:
+    '''records ingest progress in <matrix>_ingest under key: the offset of
+    the last line read, the spilled runs holding the instances read so far
+    if they are aggregated, whether all of them have been read, and the
+    number of documents committed'''
+    def __init__(self, db, matrix, key):
+        self.db = db
+        self.coll = '%s_ingest' % matrix
+        self.key = key
+        doc = self.db[self.coll].find_one({'_id': self.key}) or {}
+        self.offset = doc.get('offset', 0)
+        self.runs = doc.get('runs', [])
+        self.read = doc.get('read', False)
+        self.docs = doc.get('docs', 0)
+        self.done = doc.get('done', False)
+
+    def save(self, **progress):
+        '''commits progress, given as values of offset, runs, read, docs,
+        and done'''
+        for k, v in progress.items():
+            setattr(self, k, v)
+        self.db[self.coll].update({'_id': self.key}, {'$set': progress},
+                                  upsert=True, j=True)
+
+def aggregate_shard(shard, checkpoint, prefix, capacity=1000000, tmpdir=None,
+                    format='instances', every=0, progress=None):
+    '''sums the instances of shard in format into runs spilled to the files
+    <prefix>.<n>. if checkpoint is given, the table is spilled and the
+    offset of the last line read and the runs are committed to it every
+    every instances, so that an interrupted shard resumes from its last
+    checkpoint. returns the paths of the runs'''
+    offset, runs = 0, []
+    if checkpoint:
+        offset, runs = checkpoint.offset, checkpoint.runs
+    aggregator = Aggregator(capacity, tmpdir, prefix=prefix, runs=runs)
+    for n, (offset, i) in enumerate(read_shard(shard[0], shard[1], shard[2],
+                                               format, offset=offset), 1):
+        aggregator.add(instance_key(i), i.score)
+        if progress:
+            progress.update()
+        if checkpoint and every and n % every == 0:
+            aggregator.spill()
+            checkpoint.save(offset=offset, runs=aggregator.paths)
+    aggregator.spill()
+    if checkpoint:
+        checkpoint.save(offset=offset, runs=aggregator.paths, read=True)
+    return aggregator.paths
+
+def save_runs(writer, collection, checkpoint, runs, capacity=1000000,
+              tmpdir=None, every=0, vocab=None):
+    '''writes the (rel, args) tuples summed over the spilled runs to writer.
+    if checkpoint is given, the number of documents written is committed
+    to it every every documents, and documents have an _id made from the
+    key of checkpoint and their position in key order, so an interrupted
+    write resumes after the last committed document without duplicating
+    the ones written after it. returns the number of documents written'''
+    instances = aggregated_instances(Aggregator(capacity, tmpdir, runs=runs))
+    ids = None
+    if checkpoint:
+        instances = itertools.islice(instances, checkpoint.docs, None)
+        ids = ('%s#%d' % (checkpoint.key, n)
+               for n in itertools.count(checkpoint.docs))
+    written = writer.written
+    while True:
+        n = writer.written
+        save_instances(writer, collection,
+                       itertools.islice(instances, every or None),
+                       0, tmpdir, ids, vocab)
+        writer.flush()
+        if writer.written == n:
+            break
+        if checkpoint:
+            checkpoint.save(docs=checkpoint.docs + writer.written - n)
+    return writer.written - written
+
+def spill_shard(db, collection, shard, directory, capacity=1000000,
+                tmpdir=None, format='instances', every=0, ingest=None):
+    '''sums the instances of shard into runs spilled to files in directory,
+    committing a checkpoint of the ingest with key ingest (see
+    start_ingest) every every instances if ingest is given and every is
+    not 0. a shard with a checkpoint resumes after its last checkpoint,
+    and one that has been read returns its runs without reading it again,
+    unless its runs have been removed. returns the paths of the runs'''
+    key = '%s:%s-%s' % shard
+    checkpoint = None
+    if ingest and every:
+        checkpoint = Checkpoint(db, collection, shard_key(ingest, shard))
+        key = checkpoint.key
+        if not all(os.path.exists(r) for r in checkpoint.runs):
+            print >>sys.stderr, '%s: spilled runs are missing; reading ' \
+                'from the start' % key
+            checkpoint.save(offset=0, runs=[], read=False)
+        if checkpoint.read:
+            print >>sys.stderr, '%s: already read' % key
+            return checkpoint.runs
+        if checkpoint.offset:
+            print >>sys.stderr, '%s: resuming from offset %d (%d runs)' % \
+                (key, checkpoint.offset, len(checkpoint.runs))
+    prefix = os.path.join(directory, hashlib.md5(key).hexdigest())
+    progress = mongodb.Throughput('instances read from %s:%s-%s' % shard)
+    runs = aggregate_shard(shard, checkpoint, prefix, capacity, tmpdir,
+                           format, every, progress)
+    progress.report()
+    return runs
+
+def save_spilled(db, collection, runs, batch=1000, wc=None, capacity=1000000,
+                 tmpdir=None, every=0, encode=False, ingest=None):
+    '''writes the (rel, args) tuples summed over the runs spilled by all
+    shards of an ingest to collection, so that each tuple is written once
+    however many files or shards it appears in, committing the number of
+    documents written to the checkpoint of the ingest with key ingest
+    every every documents if ingest is given and every is not 0 (see
+    save_runs). if encode is true, strings are stored as ids from the
+    vocabulary of collection. returns the number of documents written'''
+    checkpoint = None
+    if ingest and every:
+        checkpoint = Checkpoint(db, collection, ingest)
+        if checkpoint.docs:
+            print >>sys.stderr, '%s: resuming after %d documents' % \
+                (ingest, checkpoint.docs)
+    writer = mongodb.BulkWriter(db, batch, wc,
+                                ignore_duplicates=bool(checkpoint))
+    vocab = Vocabulary(db, collection) if encode else None
+    print >>sys.stderr, 'saving tuples summed over %d runs ...' % len(runs)
+    save_runs(writer, collection, checkpoint, runs, capacity, tmpdir, every,
+              vocab)
+    print >>sys.stderr, '# %10d documents saved' % writer.written
+    return writer.written
+
+def ingest_shard(db, collection, shard, batch=1000, wc=None,
+                 format='instances', every=0, encode=False, ingest=None):
+    '''writes the instances in shard to collection as they are read,
+    committing a checkpoint of the ingest with key ingest (see
+    start_ingest) every every instances if ingest is given and every is
+    not 0. a shard with a checkpoint resumes after the last committed
+    batch. checkpointed documents have an _id made from the shard and the
+    offset of their line, so documents written after the last checkpoint
+    are not duplicated when they are written again. if encode is true,
+    strings are stored as ids from the vocabulary of collection. returns
+    the number of documents written'''
+    label = 'instances read from %s:%s-%s' % shard
+    checkpoint = None
+    if ingest and every:
+        checkpoint = Checkpoint(db, collection, shard_key(ingest, shard))
+    offset, docs = 0, 0
+    if checkpoint:
+        if checkpoint.done:
+            print >>sys.stderr, '%s: already ingested' % checkpoint.key
+            return 0
+        offset, docs = checkpoint.offset, checkpoint.docs
+        if offset:
+            print >>sys.stderr, '%s: resuming from offset %d (%d documents)' % \
+                (checkpoint.key, offset, docs)
+    writer = mongodb.BulkWriter(db, batch, wc,
+                                ignore_duplicates=bool(checkpoint))
+    vocab = Vocabulary(db, collection) if encode else None
+    progress = mongodb.Throughput(label)
+    position = [offset]
+    offsets = deque()
+    def read():
+        for offset, i in read_shard(shard[0], shard[1], shard[2], format,
+                                    offset=position[0]):
+            position[0] = offset
+            if checkpoint:
+                offsets.append(offset)
+            progress.update()
+            yield i
+    instances = read()
+    interval = every if checkpoint else None
+    while True:
+        n_read = progress.n
+        ids = line_ids(checkpoint.key, offsets) if checkpoint else None
+        save_instances(writer, collection,
+                       itertools.islice(instances, interval),
+                       0, None, ids, vocab)
+        writer.flush()
+        if progress.n == n_read:
+            break
+        if checkpoint:
+            checkpoint.save(offset=position[0], docs=docs+writer.written)
+    if checkpoint:
+        checkpoint.save(offset=position[0], docs=docs+writer.written,
+                        done=True)
+    progress.report()
+    print >>sys.stderr, '# %10d documents saved' % writer.written
+    return writer.written
+
+def shard_process(kwargs):
+    '''runs kwargs['target'] on a shard on its own connection'''
+    target = kwargs.pop('target')
+    connection = pymongo.MongoClient(kwargs.pop('host'), kwargs.pop('port'))
+    try:
+        return target(connection[kwargs.pop('db')], **kwargs)
+    finally:
+        connection.close()
+
+def create_collection_parallel(host, port, db, collection, files, workers,
+                               batch=1000, wc=None, capacity=1000000,
+                               tmpdir=None, format='instances', every=0,
+                               encode=False):
+    '''creates collection from input files using a pool of workers that
+    each parse a shard of the input, or in this process if workers is 1.
+    unless capacity is 0, the workers sum the instances of their shards
+    into runs spilled to a run directory, and the tuples summed over the
+    runs of all shards are written once; otherwise the workers write the
+    instances of their shards as they are read'''
+    shards = make_shards(files, workers)
+    connection = pymongo.MongoClient(host, port)
+    ingest = None
+    if every:
+        ingest = start_ingest(connection[db], collection, files, shards,
+                              capacity, format)
+        if ingest is None:
+            return 0
+    directory = None
+    if capacity and ingest:
+        directory = run_dir(tmpdir, collection, ingest)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+    elif capacity:
+        directory = tempfile.mkdtemp(prefix='%s_ingest_' % collection,
+                                     dir=tmpdir)
+    try:
+        print >>sys.stderr, 'ingesting %d shards with %d workers ...' % \
+            (len(shards), workers)
+        if capacity:
+            target = spill_shard
+            shard_args = [{'collection': collection, 'shard': shard,
+                           'directory': directory, 'capacity': capacity,
+                           'tmpdir': tmpdir, 'format': format,
+                           'every': every, 'ingest': ingest}
+                          for shard in shards]
+        else:
+            target = ingest_shard
+            shard_args = [{'collection': collection, 'shard': shard,
+                           'batch': batch, 'wc': wc, 'format': format,
+                           'every': every, 'encode': encode,
+                           'ingest': ingest}
+                          for shard in shards]
+        if workers > 1:
+            pool = multiprocessing.Pool(processes=workers)
+            results = pool.map(shard_process,
+                               [dict(args, target=target, host=host,
+                                     port=port, db=db)
+                                for args in shard_args])
+            pool.close()
+            pool.join()
+        else:
+            results = [target(connection[db], **args)
+                       for args in shard_args]
+        print >>sys.stderr, 'ingesting %d shards with %d workers: done.' % \
+            (len(shards), workers)
+        if capacity:
+            written = save_spilled(connection[db], collection,
+                                   [r for runs in results for r in runs],
+                                   batch, wc, capacity, tmpdir, every,
+                                   encode, ingest)
+        else:
+            written = sum(results)
+            print >>sys.stderr, '# %10d documents saved' % written
+        if ingest:
+            finish_ingest(connection[db], collection, ingest, tmpdir)
+    finally:
+        if directory and not ingest:
+            shutil.rmtree(directory, ignore_errors=True)
+    ensure_matrix_indices(connection[db], collection)
+    return written
+
+def reset_matrix(db, matrix, tmpdir=None):
+    '''drops the collections of matrix, its vocabulary, and its ingest
+    checkpoints, removing the run directories in tmpdir of unfinished
+    ingests'''
+    for x in db['%s_ingest' % matrix].find({'done': False}):
+        shutil.rmtree(run_dir(tmpdir, matrix, x['_id']), ignore_errors=True)
+    for c in get_matrix_collections(db, matrix) + \
+            ['%s_ingest' % matrix, vocab_name(matrix)]:
         fullname = mongodb.fullname(db[c])
         print >>sys.stderr, 'resetting %s ...' % fullname
         db.drop_collection(c)
@@ -169,6 +798,28 @@ if __name__ == '__main__':
     parser.add_option('-r', '--reset',
                       action='store_true', dest='reset', default=False,
                       help='''reset matrix collections. default: False''')
+    parser.add_option('-b', '--batch-size', dest='batch', type=int, default=1000,
+                      help='''number of instances per batched insert. default: 1000''')
+    parser.add_option('-w', '--write-concern', dest='w', default='1',
+                      help='''write concern for batched inserts. default: 1''')
+    parser.add_option('-j', '--journal',
+                      action='store_true', dest='journal', default=False,
+                      help='''wait for batched inserts to be journaled. default: False''')
+    parser.add_option('-a', '--aggregate', dest='capacity', type=int,
+                      default=1000000,
+                      help='''number of unique (rel,args) tuples to sum in memory before spilling to disk. 0 disables aggregation. default: 1000000''')
+    parser.add_option('--tmpdir', dest='tmpdir', default=None,
+                      help='''directory for spilled aggregation runs. default: system temp dir''')
+    parser.add_option('--workers', dest='workers', type=int, default=1,
+                      help='''number of worker processes to ingest input files with. default: 1''')
+    parser.add_option('-f', '--format', dest='format',
+                      choices=['instances', 'reverb'], default='instances',
+                      help='''input format: instances or reverb extractions. default: instances''')
+    parser.add_option('--checkpoint', dest='every', type=int, default=1000000,
+                      help='''number of instances read or documents written between ingest checkpoints. 0 disables checkpoints. default: 1000000''')
+    parser.add_option('-e', '--encode',
+                      action='store_true', dest='encode', default=False,
+                      help='''store integer ids of rel and arg strings from the <collection>_vocab vocabulary. default: False''')
     options, args = parser.parse_args()
     if len(args) < 2:
         parser.print_help()
@@ -179,7 +830,17 @@ if __name__ == '__main__':
     connection = pymongo.MongoClient(options.host, options.port)
     db = connection[db_]
 
-    if options.reset: reset_matrix(db, matrix)
+    if options.reset: reset_matrix(db, matrix, options.tmpdir)
 
-    data = (i.strip() for i in fileinput.input(files))
-    create_collection(db, matrix, data)
+    wc = mongodb.write_concern(options.w, options.journal)
+    if not files:
+        instances = read_instances(files, options.format)
+        create_collection(db, matrix, instances, options.batch, wc,
+                          options.capacity, options.tmpdir,
+                          encode=options.encode)
+    else:
+        create_collection_parallel(
+            options.host, options.port, db_, matrix, files, options.workers,
+            options.batch, wc, options.capacity, options.tmpdir,
+            options.format, options.every, options.encode
+            )
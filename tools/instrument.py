@@ -0,0 +1,202 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Author: Eric Nichols, <eric@ecei.tohoku.ac.jp>
+################################################################################
+
+'''
+`instrument.py`: records the wall time, mongodb calls, and documents
+returned by each stage of each bootstrapping iteration
+
+### Instrumentation
+
+`Instrument.wrap` returns a proxy of a database that counts every call
+of a database or collection method as one mongodb call (a bulk write is
+one call), as well as each `count`, `distinct`, or `explain` of a
+cursor, and every document returned by `find`, `find_one`, and
+`aggregate`. Documents the server scans without returning them are not
+counted. Each `Instrument.stage` records its wall time and the calls
+and documents counted while it ran:
+
+* `name`: collection of the bootstrapped relation
+* `it`: bootstrapping iteration
+* `phase`: `p` (pattern) or `i` (instance) phase of the iteration
+* `stage`: `get_I`/`get_P`, `I2P`/`P2I`, `mutex`, `rank`, `save`,
+  `snapshot`, or `ensure_index`
+* `seconds`, `calls`, `returned`
+
+Records are appended as JSON lines to a report file if one is given,
+and `summary` tabulates them by stage and by iteration.
+'''
+
+import inspect
+import json
+import sys
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+FIELDS = ('seconds', 'calls', 'returned')
+# cursor methods that query the server rather than iterate the results
+SERVER_METHODS = ('count', 'distinct', 'explain')
+
+def summarize(records, keys):
+    '''returns an ordered dictionary mapping the values of keys in records
+    to the summed seconds, calls, and returned documents of the records'''
+    totals = OrderedDict()
+    for r in records:
+        k = tuple(r[key] for key in keys)
+        t = totals.setdefault(k, dict.fromkeys(FIELDS, 0))
+        for f in FIELDS:
+            t[f] += r[f]
+    return totals
+
+def summary(records):
+    '''returns a table of the seconds, calls, and returned documents of
+    records summed by stage and by iteration'''
+    lines = ['%-5s %-12s %10s %10s %12s' %
+             ('phase', 'stage', 'seconds', 'calls', 'returned')]
+    for (phase, stage), t in summarize(records, ('phase', 'stage')).items():
+        lines.append('%-5s %-12s %10.3f %10d %12d' %
+                     (phase, stage, t['seconds'], t['calls'], t['returned']))
+    lines.append('')
+    lines.append('%-18s %10s %10s %12s' %
+                 ('it', 'seconds', 'calls', 'returned'))
+    for (it, ), t in sorted(summarize(records, ('it', )).items()):
+        lines.append('%-18d %10.3f %10d %12d' %
+                     (it, t['seconds'], t['calls'], t['returned']))
+    return '\n'.join(lines)
+
+
+class Counter:
+    '''running counts of mongodb calls and documents returned'''
+    def __init__(self):
+        self.calls = 0
+        self.returned = 0
+
+
+class CountingCursor(object):
+    '''a cursor that counts the documents returned by it, and its methods
+    that query the server as mongodb calls'''
+    def __init__(self, cursor, counter):
+        self.cursor = cursor
+        self.counter = counter
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        x = self.cursor.next()
+        self.counter.returned += 1
+        return x
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        exit_ = getattr(self.cursor, '__exit__', None)
+        if exit_:
+            return exit_(*exc)
+
+    def __getattr__(self, name):
+        attr = getattr(self.cursor, name)
+        if not inspect.ismethod(attr):
+            return attr
+        def method(*args, **kwargs):
+            if name in SERVER_METHODS:
+                self.counter.calls += 1
+            r = attr(*args, **kwargs)
+            # keep counting through chained calls such as sort and limit
+            return self if r is self.cursor else r
+        return method
+
+
+class CountingCollection(object):
+    '''a collection that counts its method calls and the documents they
+    return'''
+    def __init__(self, collection, counter):
+        self.collection = collection
+        self.counter = counter
+
+    def __getattr__(self, name):
+        attr = getattr(self.collection, name)
+        if not inspect.ismethod(attr):
+            return attr
+        def method(*args, **kwargs):
+            self.counter.calls += 1
+            r = attr(*args, **kwargs)
+            if name == 'find':
+                return CountingCursor(r, self.counter)
+            if name == 'find_one' and r is not None:
+                self.counter.returned += 1
+            if name == 'aggregate':
+                if isinstance(r, dict):
+                    self.counter.returned += len(r.get('result', []))
+                else:
+                    return CountingCursor(r, self.counter)
+            return r
+        return method
+
+
+class CountingDatabase(object):
+    '''a database whose collections count their method calls and the
+    documents they return'''
+    def __init__(self, db, counter):
+        self.db = db
+        self.counter = counter
+
+    def __getitem__(self, name):
+        return CountingCollection(self.db[name], self.counter)
+
+    def __getattr__(self, name):
+        attr = getattr(self.db, name)
+        if not inspect.ismethod(attr):
+            return attr
+        def method(*args, **kwargs):
+            self.counter.calls += 1
+            return attr(*args, **kwargs)
+        return method
+
+
+class Instrument:
+    def __init__(self, name, report=None):
+        '''initializes instrumentation of bootstrapping the collection name,
+        appending records to the JSON lines file report if it is given'''
+        self.name = name
+        self.report = report
+        self.counter = Counter()
+        self.records = []
+
+    def wrap(self, db):
+        '''returns db counting its calls and the documents they return'''
+        return CountingDatabase(db, self.counter)
+
+    @contextmanager
+    def stage(self, it, phase, stage):
+        '''records the wall time, mongodb calls, and documents returned by
+        the body of the with statement as stage of phase of iteration it'''
+        calls, returned = self.counter.calls, self.counter.returned
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add({'name': self.name, 'it': it, 'phase': phase,
+                      'stage': stage, 'seconds': time.time() - start,
+                      'calls': self.counter.calls - calls,
+                      'returned': self.counter.returned - returned})
+
+    def add(self, record):
+        '''adds record, appending it to the report'''
+        self.records.append(record)
+        if self.report:
+            with open(self.report, 'a') as f:
+                print >>f, json.dumps(record, sort_keys=True)
+
+    def take(self):
+        '''returns and forgets the records added since the last take'''
+        records, self.records = self.records, []
+        return records
+
+    def print_summary(self, out=sys.stderr):
+        '''prints a table of the records by stage and by iteration'''
+        print >>out, '%s: timing by stage and iteration' % self.name
+        print >>out, summary(self.records)
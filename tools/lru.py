@@ -0,0 +1,75 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Author: Eric Nichols, <eric@ecei.tohoku.ac.jp>
+################################################################################
+
+'''
+`lru.py`: a bounded in-process cache with hit/miss statistics
+'''
+
+from collections import OrderedDict
+
+POLICIES = ('lru', 'fifo')
+MISSING = object()
+
+
+class LRUCache:
+    def __init__(self, size=100000, policy='lru'):
+        '''initializes a cache holding at most size items, evicting the
+        least recently used item (lru) or the oldest item (fifo) when it is
+        full. a size of 0 disables caching'''
+        assert policy in POLICIES
+        self.size = size
+        self.policy = policy
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def get(self, key, default=MISSING):
+        '''returns the cached value of key, or default on a miss'''
+        try:
+            if self.policy == 'lru':
+                value = self.items.pop(key)
+                self.items[key] = value
+            else:
+                value = self.items[key]
+            self.hits += 1
+            return value
+        except KeyError:
+            self.misses += 1
+            return default
+
+    def lookup(self, key, func):
+        '''returns the cached value of key, calling func to compute and
+        cache it on a miss'''
+        value = self.get(key)
+        if value is MISSING:
+            value = func()
+            self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        '''caches value for key, evicting an item if the cache is full'''
+        if self.size <= 0:
+            return
+        self.items.pop(key, None)
+        self.items[key] = value
+        if len(self.items) > self.size:
+            self.items.popitem(last=False)
+
+    def clear(self):
+        '''empties the cache, keeping its statistics'''
+        self.items.clear()
+
+    def stats(self):
+        '''returns a string summarizing the size and hit rate of the cache'''
+        total = self.hits + self.misses
+        rate = float(self.hits) / total if total else 0.0
+        return 'cache: %d/%d items, %d hits, %d misses (%.1f%% hit rate)' % \
+            (len(self.items), self.size, self.hits, self.misses, 100.0*rate)
@@ -25,6 +25,18 @@ mongodb
                 	      3 or F_ip: instance*pattern co-occurence frequencies
 	                      4 or pmi_ip: instance*pattern discounted PMI score
                       	      default: F_i
+  	-a CAPACITY, --aggregate=CAPACITY
+  			      number of keys per frequency table to sum in
+  			      memory before spilling to disk. default: 1000000
+  	--tmpdir=TMPDIR       directory for spilled aggregation runs.
+  			      default: system temp dir
+  	-b BACKEND, --backend=BACKEND
+  			      calculate PMI by streaming collections in
+  			      mongodb (mongo) or as a sparse matrix in memory
+  			      with numpy/scipy (sparse). the sparse backend
+  			      always calculates all caches. default: mongo
+  	--artifact=ARTIFACT   directory to save sparse matrix arrays to with
+  			      the sparse backend. default: <collection>_pmi_ip
 
 ### Caches Created
 
@@ -39,6 +51,18 @@ Creates 6 caches in the form of mongodb collections:
    following [1]
 6. `<matrix>_max_pmi_ip`: caches the maximum dpmi value in <matrix>_pmi_ip
 
+The frequency caches 1-4 are computed together in a single pass over
+the matrix, summing scores in hash tables that spill sorted runs to
+disk when they exceed `--aggregate` keys.
+`<matrix>_F_ip` is indexed on the
+rel and arguments in its `_id`, so that the frequencies of a block of
+instances*patterns are looked up with a few `$in` queries.
+
+With `--backend sparse`, the matrix is instead loaded into memory as a
+sparse instance*pattern matrix, all caches are calculated as
+vectorized operations over it (see `sparse_pmi.py`), and the matrix
+and its scores are also saved as numpy arrays to `--artifact`.
+
 ### Pointwise Mutual Information
 
 Pointwise mutual information between argument instances and relation
@@ -77,23 +101,32 @@ ACL 2006.
 
 import pymongo
 import sys
-from bson.code import Code
 from bson.son import SON
 from collections import defaultdict
 from functools import partial
 from math import log
 
 import mongodb
+from aggregator import Aggregator
+from lru import LRUCache, MISSING
 from instances2matrix import ensure_indices, get_matrix_collections
 
+FREQUENCIES = ('F_all', 'F_i', 'F_p', 'F_ip')
+BLOCK = 1000
+
 
 class PMI:
-    def __init__(self, db, matrix, batch=100):
-        '''initializes class with information necessary for calculating PMI scores'''
+    def __init__(self, db, matrix, batch=100, capacity=1000000, tmpdir=None,
+                 cache_size=100000, cache_policy='lru'):
+        '''initializes class with information necessary for calculating PMI
+        scores, caching up to cache_size looked up values'''
         self.db = db
         self.matrix = matrix
         self.fullname = mongodb.fullname(self.db[self.matrix])
         self.batch = batch
+        self.capacity = capacity
+        self.tmpdir = tmpdir
+        self.cache = LRUCache(cache_size, cache_policy)
         self.argv = self.get_args()
         self.argc = len(self.argv)
         self._F_all = '%s_F_all' % self.matrix
@@ -102,7 +135,14 @@ class PMI:
         self._F_ip = '%s_F_ip' % self.matrix
         self._pmi_ip = '%s_pmi_ip' % self.matrix
         self._max_pmi_ip = '%s_max_pmi_ip' % self.matrix
-        self.F_all = self.get_F_all()
+
+    def __getattr__(self, name):
+        '''looks up F_all the first time it is used, so that make_F can
+        calculate it in its pass over <matrix> instead of a separate one'''
+        if name == 'F_all':
+            self.F_all = self.get_F_all()
+            return self.F_all
+        raise AttributeError(name)
 
     def get_args(self):
         '''returns a lists of argument names in <matrix>'''
@@ -111,107 +151,138 @@ class PMI:
                        for k in x.keys()
                        if k.startswith('arg')])
 
+    def make_F(self, tables=FREQUENCIES):
+        '''creates the frequency collections <matrix>_<table> for each of
+        F_all, F_i, F_p, and F_ip in tables in a single pass over <matrix>,
+        summing scores in bounded-memory hash tables'''
+        print >>sys.stderr, '%s: making %s counts...' % \
+            (self.fullname, ', '.join(tables))
+        keys = {'F_i': lambda i,p: i,
+                'F_p': lambda i,p: (p, ),
+                'F_ip': lambda i,p: (p, ) + i}
+        aggregators = {t:Aggregator(self.capacity, self.tmpdir)
+                       for t in tables
+                       if t in keys}
+        F_all = 0.0
+        progress = mongodb.Throughput('documents counted')
+        xs = mongodb.fast_find(self.db, self.matrix, batch=self.batch,
+                               fields=['rel', 'score'] + self.argv)
+        for x in xs:
+            score = x['score']
+            i = tuple(x[a] for a in self.argv)
+            p = x['rel']
+            F_all += score
+            for t, aggregator in aggregators.iteritems():
+                aggregator.add(keys[t](i,p), score)
+            progress.update()
+        progress.report()
+        writer = mongodb.BulkWriter(self.db, self.batch)
+        if 'F_all' in tables:
+            self.db.drop_collection(self._F_all)
+            writer.insert(self._F_all, {'_id': 'all', 'value': {'score': F_all}})
+            self.F_all = F_all
+        for t, aggregator in aggregators.iteritems():
+            c = getattr(self, '_%s' % t)
+            self.db.drop_collection(c)
+            for key, score in aggregator.items():
+                writer.insert(c, {'_id': self.key2id(t, key),
+                                  'value': {'score': score}})
+        writer.flush()
+        if 'F_ip' in tables:
+            self.index_F_ip()
+        self.cache.clear()
+        print >>sys.stderr, '%s: making %s counts: done.' % \
+            (self.fullname, ', '.join(tables))
+
+    def index_F_ip(self):
+        '''ensures an index exists on <matrix>_F_ip for looking up blocks of
+        (rel,args) by the fields of their _id'''
+        self.db[self._F_ip].ensure_index(
+            [('_id.rel', pymongo.ASCENDING)] +
+            [('_id.%s' % a, pymongo.ASCENDING) for a in self.argv],
+            background=True
+            )
+
+    def key2id(self, table, key):
+        '''returns the _id of a document in the frequency collection table
+        from its aggregation key, matching the queries in F_i, F_p, and
+        F_ip'''
+        if table == 'F_i':
+            return mongodb.make_query(i=key)
+        elif table == 'F_p':
+            return mongodb.make_query(p=key[0])
+        else:
+            return mongodb.make_query(i=key[1:], p=key[0])
+
     def make_F_all(self):
         '''creates a collection <matrix>_F_all containing total frequency of 
-        corpus and returns its name'''
-        print >>sys.stderr, '%s: making all counts...' % self.fullname
-        map_ = Code('function () {'
-                    '  emit("all", {score:this.score});'
-                    '}')
-        reduce_ = Code('function (key, values) {'
-                       '  var sum = 0;'
-                       '  values.forEach('
-                       '    function (doc) {sum += doc.score;}'
-                       '  );'
-                       '  return {score:sum};'
-                       '}')
-        r = self.db[self.matrix].map_reduce(
-            map_, reduce_, self._F_all, full_response=True
-            )
-        print >>sys.stderr, '%s: making all counts: done.' % self.fullname
+        corpus'''
+        self.make_F(['F_all'])
 
     def make_F_i(self):
         '''creates a collection <matrix>_F_i containing instance 
-        frequencinces and returns its name'''
-        print >>sys.stderr, '%s: making instance counts...' % self.fullname
-        arg_str = ['%s:this.%s'%(a,a) 
-                   for a in self.argv]
-        map_ = Code('function () {'
-                    '  var d = {};'
-                    '  for (i=1;i<=n;i++) {d["arg"+i] = this["arg"+i]}'
-                    '  emit(d, {score:this.score});'
-                    '}', n=self.argc) # pass arg count as external argument
-        reduce_ = Code('function (key, values) {'
-                       '  var sum = 0;'
-                       '  values.forEach('
-                       '    function (doc) {sum += doc.score;}'
-                       '  );'
-                       '  return {score:sum};'
-                       '}')
-        self.db[self.matrix].map_reduce(
-            map_, reduce_, self._F_i, full_response=True
-            )
-        print >>sys.stderr, '%s: making instance counts: done.' % self.fullname
+        frequencinces'''
+        self.make_F(['F_i'])
 
     def make_F_p(self):
         '''creates a collection <matrix>_F_p containing relation pattern
-        frequencinces and returns its name'''
-        print >>sys.stderr, '%s: making pattern counts...' % self.fullname
-        map_ = Code('function () {'
-                    '  emit({rel:this.rel}, {score:this.score});'
-                    '}')
-        reduce_ = Code('function (key, values) {'
-                       '  var sum = 0;'
-                       '  values.forEach('
-                       '    function (doc) {sum += doc.score;}'
-                       '  );'
-                       '  return {score:sum};'
-                       '}')
-        self.db[self.matrix].map_reduce(
-            map_, reduce_, self._F_p, full_response=True
-            )
-        print >>sys.stderr, '%s: making pattern counts: done.' % self.fullname
+        frequencinces'''
+        self.make_F(['F_p'])
 
     def make_F_ip(self):
         '''creates a collection <matrix>_F_ip containing instance*pattern
-        frequencinces and returns its name'''
-        print >>sys.stderr, '%s: making instance*pattern counts...' % self.fullname
-        arg_str = ['%s:this.%s'%(a,a) 
-                   for a in self.argv]
-        map_ = Code('function () {'
-                    '  var d = {};'
-                    '  d["rel"] = this.rel;'
-                    '  for (i=1;i<=n;i++) {d["arg"+i] = this["arg"+i]}'
-                    '  emit(d, {score:this.score});'
-                    '}', n=self.argc) # pass arg count as external argument
-        reduce_ = Code('function (key, values) {'
-                       '  var sum = 0;'
-                       '  values.forEach('
-                       '    function (doc) {sum += doc.score;}'
-                       '  );'
-                       '  return {score:sum};'
-                       '}')
-        self.db[self.matrix].map_reduce(
-            map_, reduce_, self._F_ip, full_response=True
-            )
-        print >>sys.stderr, '%s: making instance*pattern counts: done.' % self.fullname
+        frequencinces'''
+        self.make_F(['F_ip'])
+
+    def load_F(self, table):
+        '''returns a dictionary mapping the instances (for F_i) or patterns
+        (for F_p) in a frequency collection to their frequency'''
+        if table == 'F_i':
+            key = lambda _id: tuple(_id[a] for a in self.argv)
+        else:
+            key = lambda _id: _id['rel']
+        xs = mongodb.fast_find(self.db, getattr(self, '_%s' % table),
+                               batch=self.batch)
+        return {key(x['_id']):x['value']['score']
+                for x in xs}
 
     def make_pmi_ip(self):
         '''creates a collection <matrix>_pmi_ip containing instance*relation
-        Pointwise Mutual Information scores and returns its name'''
+        Pointwise Mutual Information scores by joining <matrix>_F_ip with
+        <matrix>_F_i and <matrix>_F_p loaded into memory, caching the
+        maximum dpmi to <matrix>_max_pmi_ip in the same pass'''
         print >>sys.stderr, '%s: calculating instance*pattern PMI...' % self.fullname
-        xs = mongodb.fast_find(self.db, self.matrix, batch=self.batch)
-        for n,x in enumerate(xs, 1):
-            p = x['rel']
-            rel = [('rel', p), ]
-            i = [x[a] for a in self.argv]
-            args = zip(self.argv, i)
-            pmi = zip(('dpmi', 'discount', 'pmi'), self.discounted_pmi(i,p))
-            y = SON(rel+args+pmi)
-            self.db[self._pmi_ip].save(y)
-            if n%10000 == 0:
-                print >>sys.stderr, '# %8d PMI scores calculated' % n
+        F_i = self.load_F('F_i')
+        F_p = self.load_F('F_p')
+        self.db.drop_collection(self._pmi_ip)
+        writer = mongodb.BulkWriter(self.db, self.batch)
+        progress = mongodb.Throughput('PMI scores calculated', 10000)
+        max_dpmi = 0.0
+        xs = mongodb.fast_find(self.db, self._F_ip, batch=self.batch)
+        for x in xs:
+            p = x['_id']['rel']
+            i = tuple(x['_id'][a] for a in self.argv)
+            F_ip = x['value']['score']
+            F_i_ = F_i.get(i, 0.0)
+            F_p_ = F_p.get(p, 0.0)
+            pmi = self._calc_pmi(self.F_all, F_i_, F_p_, F_ip)
+            discount = self._discount(c_ef=F_ip, c_ei=F_i_, c_jf=F_p_)
+            dpmi = pmi*discount
+            max_dpmi = max(max_dpmi, dpmi)
+            y = SON([('rel', p), ] + zip(self.argv, i) +
+                    [('dpmi', dpmi), ('discount', discount), ('pmi', pmi)])
+            writer.insert(self._pmi_ip, y)
+            progress.update()
+        writer.flush()
+        progress.report()
+        self.cache.clear()
         print >>sys.stderr, '%s: calculating instance*pattern PMI: done.' % self.fullname
+        self.save_max_pmi(max_dpmi)
+        self.index_pmi_ip()
+
+    def index_pmi_ip(self):
+        '''ensures indices exist on <matrix>_pmi_ip for (rel,args) look up
+        and for ranking by dpmi'''
         ensure_indices(self.db, self._pmi_ip)
         self.db[self._pmi_ip].ensure_index(
             [('dpmi', pymongo.DESCENDING), 
@@ -219,47 +290,167 @@ class PMI:
             )
 
     def pmi(self, i, p):
-        '''retrieves pmi value for (i,p) from matrix'''
-        try:
-            q = mongodb.make_query(i,p)
-            r = self.db[self._pmi_ip].find_one(q)
-            #print >>sys.stderr, 'pmi:', q, r
-            return r['pmi']
-        except Exception as e:
-            return 0.0
+        '''retrieves pmi value for (i,p) from matrix through the cache'''
+        return self.lookup(('pmi', tuple(i), p), lambda: self.fetch_pmi(i,p))
 
     def dpmi(self, i, p):
-        '''retrieves dpmi value for (i,p) from matrix'''
-        try:
-            q = mongodb.make_query(i,p)
-            r = self.db[self._pmi_ip].find_one(q)
-            #print >>sys.stderr, 'dpmi:', q, r
-            return r['dpmi']
-        except Exception as e:
-            return 0.0
+        '''retrieves dpmi value for (i,p) from matrix through the cache'''
+        return self.lookup(('dpmi', tuple(i), p),
+                           lambda: self.fetch_dpmi(i,p))
+
+    def lookup(self, key, fetch):
+        '''returns the value of key, taking it from the cache where possible
+        and calling fetch to retrieve and cache it otherwise. a value of 0.0
+        is returned but not cached if fetch fails, so that a failed lookup
+        is retried instead of being remembered as a zero'''
+        v = self.cache.get(key)
+        if v is MISSING:
+            try:
+                v = fetch()
+            except Exception as e:
+                print >>sys.stderr, '%s: lookup of %r failed: %s' % \
+                    (self.fullname, key, e)
+                return 0.0
+            self.cache.put(key, v)
+        return v
+
+    def lookup_many(self, kind, keys, fetch):
+        '''returns a dictionary mapping keys to their values of kind, taking
+        them from the cache where possible and calling fetch with a list of
+        the remaining keys to retrieve the rest as a dictionary. keys that
+        fetch does not return have a value of 0.0'''
+        values = {}
+        missing = []
+        for k in keys:
+            v = self.cache.get((kind, ) + k)
+            if v is MISSING:
+                missing.append(k)
+            else:
+                values[k] = v
+        if missing:
+            fetched = fetch(missing)
+            for k in missing:
+                v = fetched.get(k, 0.0)
+                values[k] = v
+                self.cache.put((kind, ) + k, v)
+        return values
+
+    def id2instance(self, _id):
+        '''returns the instance in the _id of a frequency document'''
+        return tuple(_id[a] for a in self.argv)
+
+    def find_block(self, I, P, field='dpmi'):
+        '''yields (i, p, value) of field (F_ip, pmi, or dpmi) for the (i,p)
+        in I*P that co-occur, querying <matrix>_F_ip or <matrix>_pmi_ip with
+        $in queries on rel and each argument for BLOCK instances and
+        patterns at a time'''
+        I = sorted(set(tuple(i) for i in I))
+        P = sorted(set(P))
+        if field == 'F_ip':
+            coll, prefix, fields = self._F_ip, '_id.', ['value']
+        else:
+            coll, prefix, fields = self._pmi_ip, '', ['rel', field] + self.argv
+        for Ic in mongodb.chunks(I, BLOCK):
+            wanted = set(Ic)
+            for Pc in mongodb.chunks(P, BLOCK):
+                q = {prefix + 'rel': {'$in': Pc}}
+                for n, a in enumerate(self.argv):
+                    q[prefix + a] = {'$in': sorted(set(i[n] for i in Ic))}
+                for x in self.db[coll].find(q, fields=fields):
+                    if field == 'F_ip':
+                        x, value = x['_id'], x['value']['score']
+                    else:
+                        value = x[field]
+                    i = self.id2instance(x)
+                    # the $in of each argument also matches instances
+                    # combining arguments of different instances
+                    if i in wanted:
+                        yield i, x['rel'], value
+
+    def pmi_block(self, I, P, field='dpmi'):
+        '''retrieves field (pmi or dpmi) for every (i,p) in I*P with batched
+        $in queries on <matrix>_pmi_ip, returning a dictionary mapping
+        (i,p) to its value'''
+        keys = [(tuple(i), p) for i in I for p in P]
+        def fetch(keys):
+            wanted = set(keys)
+            I_ = set(i for i,p in keys)
+            P_ = set(p for i,p in keys)
+            return {(i,p):value
+                    for i, p, value in self.find_block(I_, P_, field)
+                    if (i,p) in wanted}
+        return self.lookup_many(field, keys, fetch)
+
+    def dpmi_block(self, I, P):
+        '''retrieves dpmi for every (i,p) in I*P, returning a dictionary
+        mapping (i,p) to dpmi'''
+        return self.pmi_block(I, P, 'dpmi')
+
+    def submatrix(self, I, P, field='dpmi'):
+        '''returns the len(I) x len(P) sparse submatrix of field (F_ip,
+        pmi, or dpmi) for I*P, built from the documents of the (i,p) that
+        co-occur only. requires numpy and scipy'''
+        import numpy
+        from scipy import sparse
+        I = [tuple(i) for i in I]
+        rows = defaultdict(list)
+        for m, i in enumerate(I):
+            rows[i].append(m)
+        cols = defaultdict(list)
+        for n, p in enumerate(P):
+            cols[p].append(n)
+        row, col, data = [], [], []
+        for i, p, x in self.find_block(rows, cols, field):
+            if x:
+                for m in rows[i]:
+                    for n in cols[p]:
+                        row.append(m)
+                        col.append(n)
+                        data.append(x)
+        return sparse.coo_matrix(
+            (numpy.array(data, dtype=numpy.float64),
+             (numpy.array(row, dtype=numpy.int_),
+              numpy.array(col, dtype=numpy.int_))),
+            shape=(len(I), len(P))
+            ).tocsr()
+
+    def fetch_pmi(self, i, p):
+        '''retrieves pmi value for (i,p) from matrix, or 0.0 if (i,p) is not
+        in it'''
+        q = mongodb.make_query(i,p)
+        r = self.db[self._pmi_ip].find_one(q)
+        #print >>sys.stderr, 'pmi:', q, r
+        return r['pmi'] if r else 0.0
+
+    def fetch_dpmi(self, i, p):
+        '''retrieves dpmi value for (i,p) from matrix, or 0.0 if (i,p) is not
+        in it'''
+        q = mongodb.make_query(i,p)
+        r = self.db[self._pmi_ip].find_one(q)
+        #print >>sys.stderr, 'dpmi:', q, r
+        return r['dpmi'] if r else 0.0
+
+    def save_max_pmi(self, dpmi):
+        '''caches dpmi as the maximum dpmi to <matrix>_max_pmi_ip'''
+        self.db[self._max_pmi_ip].save(
+            {'_id': 'max', 'value': {'dpmi': dpmi}}
+            )
 
     def make_max_pmi_ip(self):
         '''caches the maximum value for dpmi in <matrix>_pmi_ip to 
-        <matrix>_max_pmi_ip'''
+        <matrix>_max_pmi_ip using the dpmi index of <matrix>_pmi_ip'''
         print >>sys.stderr, '%s: calculating max PMI...' % self.fullname
-        map_ = Code('function () {'
-                    '  emit("max", {dpmi:this.dpmi});'
-                    '}')
-        reduce_ = Code('function (key, values) {'
-                       '  var max = 0.0;'
-                       '  values.forEach('
-                       '    function (doc) {'
-                       '      if ( doc.dpmi > max )'
-                       '        max = doc.dpmi;'
-                       '    }'
-                       '  );'
-                       '  return {"dpmi" : max};'
-                       '}')
-        r = self.db[self._pmi_ip].map_reduce(
-            map_, reduce_, self._max_pmi_ip, full_response=True,
+        xs = self.db[self._pmi_ip].find(
+            fields=['dpmi'], sort=[('dpmi', pymongo.DESCENDING)], limit=1
             )
+        dpmi = max([0.0] + [x['dpmi'] for x in xs])
+        self.save_max_pmi(dpmi)
         print >>sys.stderr, '%s: calculating max PMI: done.' % self.fullname
 
+    def stats(self):
+        '''returns a string summarizing the look up cache'''
+        return self.cache.stats()
+
     def max_pmi(self):
         '''finds maximum pmi value in matrix'''
         r = self.db[self._max_pmi_ip].find_one()
@@ -280,49 +471,84 @@ class PMI:
         return r2score(r)
 
     def F_i(self, i):
-        '''calculate the frequency (i.e. the sum of scores) of an argument 
-        instance'''
-        try:
-            query = {'_id': mongodb.make_query(i)}
-            #print >>sys.stderr, 'query:', query
-            #print >>sys.stderr, self.db[self._F_i].find(query).explain()
-            v = self.db[self._F_i].find_one(query, fields=['value'])
-            #print >>sys.stderr, 'v:', v
-            return v['value']['score']
-        except Exception as e:
-            #print >>sys.stderr, e, i
-            #raise e
-            return 0.0
+        '''retrieves the frequency of an argument instance through the
+        cache'''
+        return self.lookup(('F_i', tuple(i)), lambda: self.fetch_F_i(i))
 
     def F_p(self, p):
-        '''calculate the frequency (i.e. the sum of scores) of a relation 
-        pattern'''
-        try:
-            query = {'_id': mongodb.make_query(i=None,p=p)}
-            #print >>sys.stderr, 'query:', query
-            #print >>sys.stderr, self.db[self._F_p].find(query).explain()
-            v = self.db[self._F_p].find_one(query, fields=['value'])
-            #print >>sys.stderr, 'v:', v
-            return v['value']['score']
-        except Exception as e:
-            #print >>sys.stderr, e, p
-            #raise e
-            return 0.0
+        '''retrieves the frequency of a relation pattern through the
+        cache'''
+        return self.lookup(('F_p', p), lambda: self.fetch_F_p(p))
 
     def F_ip(self, i, p):
+        '''retrieves the co-occurence frequency of instance*pattern through
+        the cache'''
+        return self.lookup(('F_ip', tuple(i), p),
+                           lambda: self.fetch_F_ip(i,p))
+
+    def F_i_many(self, I):
+        '''retrieves the frequencies of instances in I with batched $in
+        queries, returning a dictionary mapping i to F_i'''
+        def fetch(keys):
+            ids = [mongodb.make_query(i) for i, in keys]
+            xs = mongodb.find_in(self.db, self._F_i, ids, BLOCK)
+            return {(self.id2instance(x['_id']), ):x['value']['score']
+                    for x in xs}
+        values = self.lookup_many('F_i', [(tuple(i), ) for i in I], fetch)
+        return {k[0]:v for k,v in values.iteritems()}
+
+    def F_p_many(self, P):
+        '''retrieves the frequencies of patterns in P with batched $in
+        queries, returning a dictionary mapping p to F_p'''
+        def fetch(keys):
+            ids = [mongodb.make_query(i=None,p=p) for p, in keys]
+            xs = mongodb.find_in(self.db, self._F_p, ids, BLOCK)
+            return {(x['_id']['rel'], ):x['value']['score']
+                    for x in xs}
+        values = self.lookup_many('F_p', [(p, ) for p in P], fetch)
+        return {k[0]:v for k,v in values.iteritems()}
+
+    def F_ip_block(self, I, P):
+        '''retrieves the co-occurence frequency of every (i,p) in I*P with
+        batched $in queries on rel and each argument, returning a
+        dictionary mapping (i,p) to F_ip that defaults to 0.0 for pairs
+        that do not co-occur. the frequencies found are cached for F_ip,
+        while the zeros of the rest are not'''
+        values = defaultdict(float)
+        for i, p, value in self.find_block(I, P, 'F_ip'):
+            values[(i,p)] = value
+            self.cache.put(('F_ip', i, p), value)
+        return values
+
+    def fetch_F_i(self, i):
+        '''calculate the frequency (i.e. the sum of scores) of an argument 
+        instance'''
+        query = {'_id': mongodb.make_query(i)}
+        #print >>sys.stderr, 'query:', query
+        #print >>sys.stderr, self.db[self._F_i].find(query).explain()
+        v = self.db[self._F_i].find_one(query, fields=['value'])
+        #print >>sys.stderr, 'v:', v
+        return v['value']['score'] if v else 0.0
+
+    def fetch_F_p(self, p):
+        '''calculate the frequency (i.e. the sum of scores) of a relation 
+        pattern'''
+        query = {'_id': mongodb.make_query(i=None,p=p)}
+        #print >>sys.stderr, 'query:', query
+        #print >>sys.stderr, self.db[self._F_p].find(query).explain()
+        v = self.db[self._F_p].find_one(query, fields=['value'])
+        #print >>sys.stderr, 'v:', v
+        return v['value']['score'] if v else 0.0
+
+    def fetch_F_ip(self, i, p):
         '''calculate the co-occurence frequency (i.e. the sum of scores) of 
-        instance*pattern'''        
-        try:
-            query = {'_id': mongodb.make_query(i,p)}
-            #print >>sys.stderr, 'query:', query
-            #print >>sys.stderr, self.db[self._F_ip].find(query).explain()
-            v = self.db[self._F_ip].find_one(query, fields=['value'])
-            #print >>sys.stderr, 'v:', v
-            return v['value']['score']
-        except Exception as e:
-            #print >>sys.stderr, e, i, p
-            #raise e
-            return 0.0
+        instance*pattern'''
+        query = {'_id': mongodb.make_query(i,p)}
+        #print >>sys.stderr, 'query:', query
+        #print >>sys.stderr, self.db[self._F_ip].find(query).explain()
+        v = self.db[self._F_ip].find_one(query, fields=['value'])
+        #print >>sys.stderr, 'v:', v
+        return v['value']['score'] if v else 0.0
 
     def calc_pmi(self, i, p):
         '''pmi: pointwise mutual information between instance and pattern'''
@@ -375,6 +601,8 @@ class PMI:
             print >>sys.stderr, 'resetting %s ...' % fullname
             self.db.drop_collection(self.db[c])
             print >>sys.stderr, 'resetting %s: done.' % fullname
+        self.cache.clear()
+        self.__dict__.pop('F_all', None)
 
 
 def validate_start(s):
@@ -408,13 +636,23 @@ def main():
                               5 or pmi_ip: instance*pattern Pointwise Mutual Information score
                               6 or max_pmi_ip: maximum Pointwise Mutual Information score
                               default: F_i''')
+    parser.add_option('-a', '--aggregate', dest='capacity', type=int,
+                      default=1000000,
+                      help='''number of keys per frequency table to sum in memory before spilling to disk. default: 1000000''')
+    parser.add_option('--tmpdir', dest='tmpdir', default=None,
+                      help='''directory for spilled aggregation runs. default: system temp dir''')
+    parser.add_option('-b', '--backend', dest='backend',
+                      choices=['mongo', 'sparse'], default='mongo',
+                      help='''calculate PMI by streaming collections in mongodb or as a sparse matrix in memory with numpy/scipy. the sparse backend always calculates all caches. default: mongo''')
+    parser.add_option('--artifact', dest='artifact', default=None,
+                      help='''directory to save sparse matrix arrays to with the sparse backend. default: <collection>_pmi_ip''')
     options, args = parser.parse_args()
     if len(args) != 2:
         parser.print_help()
         exit(1)
     start = validate_start(options.start)
     if start == 0:
-        print >>sys.stderr, 'start option is invalid! %s' % option.start
+        print >>sys.stderr, 'start option is invalid! %s' % options.start
         parser.print_help()
         exit(1)
 
@@ -422,20 +660,27 @@ def main():
     connection = pymongo.Connection(options.host, options.port)
 
     for c in get_matrix_collections(connection[db], collection):
-        p = PMI(connection[db], c)
+        p = PMI(connection[db], c, capacity=options.capacity,
+                tmpdir=options.tmpdir)
         if options.reset:
             p.do_reset()
-        if start <= 1:
-            p.make_F_all()
-        if start <= 2:
-            p.make_F_i()
-        if start <= 3:
-            p.make_F_p()
-        if start <= 4:
-            p.make_F_ip()
+        if options.backend == 'sparse':
+            import sparse_pmi
+            s = sparse_pmi.SparsePMI(p)
+            s.load()
+            s.calculate()
+            s.save()
+            s.save_artifact(options.artifact or '%s_pmi_ip' % c)
+            continue
+        tables = [t 
+                  for n,t in enumerate(FREQUENCIES, 1)
+                  if start <= n]
+        if tables:
+            p.make_F(tables)
         if start <= 5:
+            # also caches max_pmi_ip
             p.make_pmi_ip()
-        if start <= 6:
+        elif start <= 6:
             p.make_max_pmi_ip()
 
 if __name__ == '__main__':
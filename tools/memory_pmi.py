@@ -0,0 +1,212 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Author: Eric Nichols, <eric@ecei.tohoku.ac.jp>
+################################################################################
+
+'''
+`memory_pmi.py`: holds a co-occurence matrix and its discounted PMI
+scores in memory for bootstrapping without database look ups
+
+### In-Memory Engine
+
+`MemoryPMI` answers the same look ups as `matrix2pmi.PMI` from the
+arrays of a `sparse_pmi.SparsePMI` artifact, so scorers can use it in
+place of the database: CSR (instance->patterns) and CSC
+(pattern->instances) adjacency arrays, the frequency and PMI values of
+each non-zero entry, and sorted instance and pattern labels that are
+searched with `numpy.searchsorted` to find rows and columns. Candidate
+patterns and instances are found by reading rows and columns of the
+adjacency arrays.
+
+The arrays are either calculated in memory from the matrix with
+`calculate`, or opened from an artifact directory with `open_artifact`
+as read-only memory maps, which lets all processes bootstrapping the
+same matrix share a single copy of it.
+'''
+
+import numpy
+import sys
+from collections import defaultdict
+from scipy import sparse
+
+from sparse_pmi import SparsePMI, load_artifact, \
+    instance2label, value2label, label2instance, label2value
+
+FIELDS = ('F_ip', 'pmi', 'dpmi')
+
+
+def calculate(pmi):
+    '''loads the matrix of a matrix2pmi.PMI and calculates its scores in
+    memory, returning the metadata and arrays of its artifact'''
+    sp = SparsePMI(pmi)
+    sp.load()
+    sp.calculate()
+    return sp.meta(), sp.arrays()
+
+def publish(pmi, path):
+    '''loads the matrix of a matrix2pmi.PMI, calculates its scores, and
+    saves them as an artifact to path for processes to open with
+    open_artifact'''
+    sp = SparsePMI(pmi)
+    sp.load()
+    sp.calculate()
+    sp.save_artifact(path)
+
+def open_artifact(path):
+    '''returns a MemoryPMI reading the artifact in path through read-only
+    memory maps'''
+    print >>sys.stderr, 'opening artifact %s ...' % path
+    meta, arrays = load_artifact(path, mmap_mode='r')
+    return MemoryPMI(meta, arrays)
+
+def find(labels, xs):
+    '''returns an array of the positions of labels xs in the sorted array
+    labels, with -1 for labels that are not found'''
+    if not len(xs) or not len(labels):
+        return numpy.zeros(len(xs), dtype=numpy.int64) - 1
+    xs = numpy.array(xs)
+    k = numpy.searchsorted(labels, xs)
+    found = labels[numpy.minimum(k, len(labels)-1)] == xs
+    return numpy.where(found & (k < len(labels)), k, -1)
+
+def gather(indptr, indices, rows):
+    '''returns arrays of the position in rows, entry number, and column of
+    every non-zero entry of rows of a CSR structure'''
+    m = numpy.flatnonzero(rows >= 0)
+    starts = indptr[rows[m]].astype(numpy.int64)
+    lengths = indptr[rows[m]+1] - starts
+    offsets = numpy.repeat(starts - numpy.cumsum(lengths) + lengths, lengths)
+    k = offsets + numpy.arange(lengths.sum())
+    return numpy.repeat(m, lengths), k, indices[k]
+
+
+class MemoryPMI:
+    def __init__(self, meta, arrays):
+        '''initializes class with the metadata and arrays of a
+        sparse_pmi.SparsePMI artifact'''
+        self.meta = meta
+        self.arrays = arrays
+        self.encoded = meta['encoded']
+        self.F_all = meta['F_all']
+        self.instances = arrays['instances']
+        self.patterns = arrays['patterns']
+
+    def stats(self):
+        '''returns a string summarizing the size of the matrix'''
+        return 'in memory: %d x %d, %d non-zero' % \
+            (len(self.instances), len(self.patterns),
+             len(self.arrays['indices']))
+
+    def max_pmi(self):
+        '''returns the maximum dpmi value in matrix'''
+        return self.meta['max_dpmi']
+
+    def rows(self, I):
+        '''returns an array of the rows of instances I, -1 if missing'''
+        return find(self.instances, [instance2label(i) for i in I])
+
+    def cols(self, P):
+        '''returns an array of the columns of patterns P, -1 if missing'''
+        return find(self.patterns, [value2label(p) for p in P])
+
+    def match_P(self, I):
+        '''yields (p, number of instances in I matching p) for patterns
+        that co-occur with an instance in I'''
+        a = self.arrays
+        m, k, cols = gather(a['indptr'], a['indices'], self.rows(I))
+        cols, counts = numpy.unique(cols, return_counts=True)
+        for n, count in zip(cols, counts):
+            yield label2value(self.patterns[n], self.encoded), int(count)
+
+    def match_I(self, P):
+        '''yields (i, number of patterns in P matching i) for instances
+        that co-occur with a pattern in P'''
+        a = self.arrays
+        n, k, rows = gather(a['T_indptr'], a['T_indices'], self.cols(P))
+        rows, counts = numpy.unique(rows, return_counts=True)
+        for m, count in zip(rows, counts):
+            yield label2instance(self.instances[m], self.encoded), int(count)
+
+    def submatrix(self, I, P, field='dpmi'):
+        '''returns the len(I) x len(P) sparse submatrix of field (F_ip,
+        pmi, or dpmi) for I*P'''
+        a = self.arrays
+        cols = self.cols(P)
+        n = numpy.flatnonzero(cols >= 0)
+        order = numpy.argsort(cols[n])
+        wanted, position = cols[n][order], n[order]
+        m, k, c = gather(a['indptr'], a['indices'], self.rows(I))
+        hit = numpy.in1d(c, wanted)
+        m, k, c = m[hit], k[hit], c[hit]
+        return sparse.csr_matrix(
+            (a[field][k], (m, position[numpy.searchsorted(wanted, c)])),
+            shape=(len(I), len(P))
+            )
+
+    def block(self, I, P, field):
+        '''returns a dictionary mapping (i,p) in I*P to its value of field,
+        defaulting to 0.0 for pairs that do not co-occur'''
+        I = [tuple(i) for i in I]
+        S = self.submatrix(I, P, field).tocoo()
+        values = defaultdict(float)
+        for m, n, v in zip(S.row, S.col, S.data):
+            values[(I[m], P[n])] = float(v)
+        return values
+
+    def pmi_block(self, I, P, field='dpmi'):
+        '''returns a dictionary mapping (i,p) in I*P to field (pmi or
+        dpmi)'''
+        return self.block(I, P, field)
+
+    def dpmi_block(self, I, P):
+        '''returns a dictionary mapping (i,p) in I*P to dpmi'''
+        return self.block(I, P, 'dpmi')
+
+    def F_ip_block(self, I, P):
+        '''returns a dictionary mapping (i,p) in I*P to F_ip'''
+        return self.block(I, P, 'F_ip')
+
+    def F_i_many(self, I):
+        '''returns a dictionary mapping i in I to F_i'''
+        F_i = self.arrays['F_i']
+        return {tuple(i):(float(F_i[m]) if m >= 0 else 0.0)
+                for i, m in zip(I, self.rows(I))}
+
+    def F_p_many(self, P):
+        '''returns a dictionary mapping p in P to F_p'''
+        F_p = self.arrays['F_p']
+        return {p:(float(F_p[n]) if n >= 0 else 0.0)
+                for p, n in zip(P, self.cols(P))}
+
+    def value(self, i, p, field):
+        '''returns the value of field for (i,p), or 0.0 if they do not
+        co-occur'''
+        m, n = self.rows([i])[0], self.cols([p])[0]
+        if m < 0 or n < 0:
+            return 0.0
+        a = self.arrays
+        start, end = a['indptr'][m], a['indptr'][m+1]
+        k = start + numpy.searchsorted(a['indices'][start:end], n)
+        if k < end and a['indices'][k] == n:
+            return float(a[field][k])
+        return 0.0
+
+    def pmi(self, i, p):
+        '''returns the pmi value of (i,p)'''
+        return self.value(i, p, 'pmi')
+
+    def dpmi(self, i, p):
+        '''returns the dpmi value of (i,p)'''
+        return self.value(i, p, 'dpmi')
+
+    def F_ip(self, i, p):
+        '''returns the co-occurence frequency of (i,p)'''
+        return self.value(i, p, 'F_ip')
+
+    def F_i(self, i):
+        '''returns the frequency of instance i'''
+        return self.F_i_many([i])[tuple(i)]
+
+    def F_p(self, p):
+        '''returns the frequency of pattern p'''
+        return self.F_p_many([p])[p]
@@ -7,8 +7,11 @@ import logging
 import math
 import pymongo
 import sys
+import time
 from bson.son import SON
+from collections import defaultdict
 from itertools import islice
+from pymongo.errors import BulkWriteError
 from os.path import basename
 
 logger = logging.getLogger()
@@ -32,9 +35,9 @@ def make_query(i=None, p=None):
     index order'''
     q = SON()
     #q = {}
-    if p:
+    if p is not None:
         q['rel'] = p
-    if i:
+    if i is not None:
         for k,v in i2query(i):
             q[k] = v
     #print >>sys.stderr, 'make_query:', i, p, q
@@ -101,3 +104,113 @@ def fast_find(db, c, query={}, batch=1000, **kwargs):
         for y in xrange(slices):
             for x in islice(xs, batch):
                 yield x
+
+
+def chunks(xs, n):
+    '''yields successive lists of n items from xs'''
+    xs = list(xs)
+    for k in xrange(0, len(xs), n):
+        yield xs[k:k+n]
+
+def find_in(db, c, ids, batch=1000, **kwargs):
+    '''yields the documents in db.c with an _id in ids, querying batch ids
+    at a time'''
+    for chunk in chunks(ids, batch):
+        for x in db[c].find({'_id': {'$in': chunk}}, **kwargs):
+            yield x
+
+def aggregate(db, c, pipeline):
+    '''yields the results of an aggregation pipeline over db.c, reading
+    them from a cursor so that they are not limited in size'''
+    r = db[c].aggregate(pipeline, cursor={}, allowDiskUse=True)
+    if isinstance(r, dict):
+        r = r['result']
+    for x in r:
+        yield x
+
+def upsert_many(db, coll, docs, keys, wc=None):
+    '''writes docs to db.coll with a single unordered bulk operation,
+    replacing the document that matches each doc on keys or inserting doc
+    if there is none, so that the same docs can be written again'''
+    if not docs:
+        return
+    bulk = db[coll].initialize_unordered_bulk_op()
+    for doc in docs:
+        bulk.find(SON((k, doc[k]) for k in keys)).upsert().replace_one(doc)
+    bulk.execute(wc or write_concern())
+
+def write_concern(w='1', j=False):
+    '''returns a write concern document from a command line value for w,
+    converting numeric values to int'''
+    try:
+        w = int(w)
+    except ValueError:
+        pass
+    wc = {'w': w}
+    if j:
+        wc['j'] = True
+    return wc
+
+class BulkWriter:
+    '''buffers documents separately for each collection and writes them
+    as unordered batched inserts, optionally ignoring documents whose _id
+    already exists'''
+    def __init__(self, db, batch=1000, wc=None, ignore_duplicates=False):
+        self.db = db
+        self.batch = batch
+        self.wc = wc or write_concern()
+        self.ignore_duplicates = ignore_duplicates
+        self.buffers = defaultdict(list)
+        self.written = 0
+
+    def insert(self, coll, doc):
+        '''buffers doc for coll, writing the buffer once it is full'''
+        buf = self.buffers[coll]
+        buf.append(doc)
+        if len(buf) >= self.batch:
+            self.flush(coll)
+
+    def flush(self, coll=None):
+        '''writes buffered documents for coll, or for all collections if
+        coll is None'''
+        colls = [coll] if coll else self.buffers.keys()
+        for c in colls:
+            docs = self.buffers.pop(c, [])
+            if not docs:
+                continue
+            bulk = self.db[c].initialize_unordered_bulk_op()
+            for d in docs:
+                bulk.insert(d)
+            try:
+                bulk.execute(self.wc)
+            except BulkWriteError as e:
+                errors = e.details.get('writeErrors', [])
+                if not self.ignore_duplicates or \
+                        any(err['code'] != 11000 for err in errors) or \
+                        e.details.get('writeConcernErrors'):
+                    raise
+            self.written += len(docs)
+
+class Throughput:
+    '''reports progress as a running count and rate every n updates'''
+    def __init__(self, label, every=100000, out=sys.stderr):
+        self.label = label
+        self.every = every
+        self.out = out
+        self.n = 0
+        self.next = every
+        self.start = time.time()
+
+    def rate(self):
+        elapsed = time.time() - self.start
+        return self.n / elapsed if elapsed > 0 else 0.0
+
+    def update(self, n=1):
+        self.n += n
+        if self.n >= self.next:
+            self.report()
+            while self.next <= self.n:
+                self.next += self.every
+
+    def report(self):
+        print >>self.out, '# %10d %s (%.1f/s)' % (self.n, self.label, self.rate())
@@ -13,6 +13,7 @@ import pymongo
 import sys
 
 import mongodb
+import vocab
 
 def main():
     from optparse import OptionParser
@@ -22,6 +23,8 @@ def main():
                       help='''mongodb host machine name. default: localhost''')    
     parser.add_option('-p', '--port', dest='port', type=int, default=27017,
                       help='''mongodb host machine port number. default: 27017''')
+    parser.add_option('-v', '--vocab', dest='vocab', default=None,
+                      help='''decode ids with the vocabulary of an encoded matrix collection. default: None''')
     options, args = parser.parse_args()
     if len(args) != 2:
         parser.print_help()
@@ -33,7 +36,12 @@ def main():
         sys.stdout, 
         ('it', 'score', 'rel'),
         extrasaction='ignore')
+    vocab_ = vocab.Vocabulary(db, options.vocab) if options.vocab else None
     for r in mongodb.fast_find(db, coll):
+        if vocab_:
+            for k in ('rel',):
+                if k in r:
+                    r[k] = vocab_.decode(r[k])
         esp_i_writer.writerow(r)
 
 if __name__ == '__main__':
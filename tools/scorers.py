@@ -7,61 +7,91 @@
 `scorers.py`: scorers for use in bootstrapping algorithms
 '''
 
+import heapq
 import sys
 
 import matrix2pmi
 import mongodb
 
+def top_n(scores, n=None):
+    '''returns the n (candidate, score) pairs of scores with the highest
+    scores, breaking ties by candidate, keeping only n pairs at a time in
+    a heap. all pairs are returned in ranked order if n is None'''
+    key = lambda x: (-x[1], x[0])
+    if n is None:
+        return sorted(scores, key=key)
+    return heapq.nsmallest(n, scores, key=key)
+
+def pattern_doc(p, it, score):
+    '''returns a document for pattern p promoted in iteration it'''
+    return {'rel':p, 'it':it, 'score':score}
+
+def instance_doc(i, it, score):
+    '''returns a document for instance i promoted in iteration it'''
+    r = {'arg%d'%n:v
+         for n,v in enumerate(i, 1)}
+    r['it'] = it
+    r['score'] = score
+    return r
+
 class PrecisionCountScorer:
     __short__ = 'pc'
-    def __init__(self, db, matrix, boot_i, boot_p, logger):
+    def __init__(self, db, matrix, boot_i, boot_p, logger,
+                 cache_size=100000, cache_policy='lru'):
         self.db = db
         self.matrix = matrix
         self.boot_i = boot_i
         self.boot_p = boot_p
-        self.pmi = matrix2pmi.PMI(db, matrix)
+        self.pmi = matrix2pmi.PMI(db, matrix, cache_size=cache_size,
+                                  cache_policy=cache_policy)
         self.max_pmi = self.pmi.max_pmi()
         self.logger = logger
 
-    def precision_p(self, I, p):
+    def precision_p(self, I, p, F_ip=None, F_p=None):
         '''precision is the sum of the number of instances promoted by
-        a pattern divided by the count of the pattern'''
+        a pattern divided by the count of the pattern. F_ip and F_p are
+        dictionaries of frequencies retrieved in bulk for I*P and P, and
+        are looked up if they are not given'''
         try:
-            prec = sum( [self.pmi.F_ip(i,p) for i in I] ) / self.pmi.F_p(p)
+            if F_ip is None:
+                F_ip = self.pmi.F_ip_block(I, [p])
+            if F_p is None:
+                F_p = self.pmi.F_p_many([p])
+            prec = sum( [F_ip[(tuple(i),p)] for i in I] ) / F_p[p]
             self.logger.info('precision_p: %s %f' % (p, prec))
             return prec
         except Exception as e:
             return 0.0
 
-    def pattern_count(self, i, P):
-        '''returns the number of patterns that are promoting an instance'''
+    def pattern_count(self, i, P, F_ip=None):
+        '''returns the number of patterns that are promoting an instance.
+        F_ip is a dictionary of frequencies retrieved in bulk for I*P, and
+        is looked up if it is not given'''
         try:
+            if F_ip is None:
+                F_ip = self.pmi.F_ip_block([i], P)
             # pcount = len( filter(lambda x: x>0.0,
             #                      [self.pmi.F_ip(i,p) for p in P]) )
-            pcount = sum( [self.pmi.F_ip(i,p) for p in P] )
+            i = tuple(i)
+            pcount = sum( [F_ip[(i,p)] for p in P] )
             self.logger.info('pattern_count: %s %f' % (i, pcount))
             return pcount
         except Exception as e:
             return 0.0        
 
-    def rank_patterns(self, I, P, it):
-        '''return a list of patterns ranked by reliability score'''
-        rs = [{'rel':p, 'it':it, 'score':self.precision_p(I,p)} 
-              for p in P]
-        rs.sort(key=lambda r: r.get('score',0.0),reverse=True)
-        return rs
+    def rank_patterns(self, I, P, it, n=None):
+        '''return a list of the top n patterns ranked by reliability score'''
+        F_ip = self.pmi.F_ip_block(I, P)
+        F_p = self.pmi.F_p_many(P)
+        scores = ((p, self.precision_p(I,p,F_ip,F_p)) for p in P)
+        return [pattern_doc(p, it, score) for p, score in top_n(scores, n)]
 
-    def rank_instances(self, I, P, it):
-        '''return a list of instances ranked by reliability score'''
-        rs = []
-        for i in I:
-            r = {'arg%d'%n:v
-                 for n,v in enumerate(i, 1)}
-            r['it'] = it
-            r['score'] = self.pattern_count(i,P)
-            rs.append(r)
-        rs.sort(key=lambda r: r.get('score',0.0),reverse=True)
-        return rs
+    def rank_instances(self, I, P, it, n=None):
+        '''return a list of the top n instances ranked by reliability
+        score'''
+        F_ip = self.pmi.F_ip_block(I, P)
+        scores = ((tuple(i), self.pattern_count(i,P,F_ip)) for i in I)
+        return [instance_doc(i, it, score) for i, score in top_n(scores, n)]
 
 
 class ReliabilityScorer:
@@ -81,21 +111,26 @@ class ReliabilityScorer:
     and r_p are recursively defined with r_i=1.0 for the seed instances.
     '''
     __short__ = 'rel'
-    def __init__(self, db, matrix, boot_i, boot_p, logger):
+    def __init__(self, db, matrix, boot_i, boot_p, logger,
+                 cache_size=100000, cache_policy='lru'):
         self.db = db
         self.matrix = matrix
         self.boot_i = boot_i
         self.boot_p = boot_p
-        self.pmi = matrix2pmi.PMI(db, matrix)
+        self.pmi = matrix2pmi.PMI(db, matrix, cache_size=cache_size,
+                                  cache_policy=cache_policy)
         self.max_pmi = self.pmi.max_pmi()
         self.logger = logger
+        # state of the bootstrapper mapping promoted instances (i) and
+        # patterns (p) to their iteration and score, if it has one
+        self.memo = None
 
     def _r_i(self, i):
         '''retrieves r_i for past iteration'''
         try:
             query = mongodb.make_query(i=i,p=None)
             r = self.db[self.boot_i].find_one(query, fields=['score'])
-            self.logger.debug('_r_i: %f' % r)
+            self.logger.debug('_r_i: %f' % r.get('score',0.0))
             return r.get('score',0.0)
         except Exception as e:
             return 0.0
@@ -105,45 +140,157 @@ class ReliabilityScorer:
         try:
             query = mongodb.make_query(i=None,p=p)
             r = self.db[self.boot_p].find_one(query, fields=['score'])
-            self.logger.debug('_r_p: %f' % r)
+            self.logger.debug('_r_p: %f' % r.get('score',0.0))
             return r.get('score',0.0)
         except Exception as e:
             return 0.0
 
-    def r_i(self, i, P):
-        '''r_i: reliability of instance i'''
-        r = sum( [self.pmi.dpmi(i,p)*self._r_p(p) / self.max_pmi 
+    def _r_i_many(self, I):
+        '''retrieves r_i for past iteration for all instances in I with
+        batched $in queries, or from the memo, returning a dictionary
+        mapping i to r_i'''
+        I = set(tuple(i) for i in I)
+        if self.memo is not None:
+            return {i:self.memo['i'].get(i, (None, 0.0))[1] for i in I}
+        rs = {i:0.0 for i in I}
+        for chunk in mongodb.chunks(sorted(I), matrix2pmi.BLOCK):
+            args = ['arg%d'%n for n in xrange(1, len(chunk[0])+1)]
+            query = {a:{'$in': sorted(set(i[n] for i in chunk))}
+                     for n,a in enumerate(args)}
+            for r in self.db[self.boot_i].find(query, fields=args+['score']):
+                i = tuple(r[a] for a in args)
+                if i in I and not rs[i]:
+                    rs[i] = r.get('score',0.0)
+        return rs
+
+    def _r_p_many(self, P):
+        '''retrieves r_p for past iteration for all patterns in P with
+        batched $in queries, or from the memo, returning a dictionary
+        mapping p to r_p'''
+        if self.memo is not None:
+            return {p:self.memo['p'].get(p, (None, 0.0))[1] for p in P}
+        rs = {p:0.0 for p in P}
+        for chunk in mongodb.chunks(sorted(set(P)), matrix2pmi.BLOCK):
+            query = {'rel': {'$in': chunk}}
+            for r in self.db[self.boot_p].find(query, fields=['rel', 'score']):
+                if not rs[r['rel']]:
+                    rs[r['rel']] = r.get('score',0.0)
+        return rs
+
+    def r_i(self, i, P, dpmi=None, r_p=None):
+        '''r_i: reliability of instance i. dpmi and r_p are dictionaries of
+        scores retrieved in bulk for I*P and P, and are looked up if they
+        are not given'''
+        if dpmi is None:
+            dpmi = self.pmi.dpmi_block([i], P)
+        if r_p is None:
+            r_p = self._r_p_many(P)
+        i = tuple(i)
+        r = sum( [dpmi[(i,p)]*r_p[p] / self.max_pmi 
                   for p in P] ) / len(P)
         self.logger.info('r_i: %s %f' % (i, r))
         return r
 
-    def r_p(self, I, p):
-        '''r_p: reliability of pattern p'''
-        r = sum( [self.pmi.dpmi(i,p)*self._r_i(i) / self.max_pmi 
+    def r_p(self, I, p, dpmi=None, r_i=None):
+        '''r_p: reliability of pattern p. dpmi and r_i are dictionaries of
+        scores retrieved in bulk for I*P and I, and are looked up if they
+        are not given'''
+        if dpmi is None:
+            dpmi = self.pmi.dpmi_block(I, [p])
+        if r_i is None:
+            r_i = self._r_i_many(I)
+        r = sum( [dpmi[(tuple(i),p)]*r_i[tuple(i)] / self.max_pmi 
                   for i in I] ) / len(I)
         self.logger.info('r_p: %s %f' % (p, r))
         return r
 
-    def S(self, i, P):
+    def S(self, i, P, dpmi=None, r_p=None):
         '''confidence in an instance'''
-        T = sum ( [ self._r_p(p) for p in P ] )
-        return sum ( [ self.pmi.dpmi(i,p)*self._r_p(p)/T for p in P ] )
-
-    def rank_patterns(self, I, P, it):
-        '''return a list of patterns ranked by reliability score'''
-        rs = [{'rel':p, 'it':it, 'score':self.r_p(I,p)} 
-              for p in P]
-        rs.sort(key=lambda r: r.get('score',0.0),reverse=True)
-        return rs
+        if dpmi is None:
+            dpmi = self.pmi.dpmi_block([i], P)
+        if r_p is None:
+            r_p = self._r_p_many(P)
+        i = tuple(i)
+        T = sum ( [ r_p[p] for p in P ] )
+        return sum ( [ dpmi[(i,p)]*r_p[p]/T for p in P ] )
 
-    def rank_instances(self, I, P, it):
-        '''return a list of instances ranked by reliability score'''
-        rs = []
-        for i in I:
-            r = {'arg%d'%n:v
-                 for n,v in enumerate(i, 1)}
-            r['it'] = it
-            r['score'] = self.r_i(i,P)
-            rs.append(r)
-        rs.sort(key=lambda r: r.get('score',0.0),reverse=True)
-        return rs
+    def rank_patterns(self, I, P, it, n=None):
+        '''return a list of the top n patterns ranked by reliability score'''
+        dpmi = self.pmi.dpmi_block(I, P)
+        r_i = self._r_i_many(I)
+        scores = ((p, self.r_p(I,p,dpmi,r_i)) for p in P)
+        return [pattern_doc(p, it, score) for p, score in top_n(scores, n)]
+
+    def rank_instances(self, I, P, it, n=None):
+        '''return a list of the top n instances ranked by reliability
+        score'''
+        dpmi = self.pmi.dpmi_block(I, P)
+        r_p = self._r_p_many(P)
+        scores = ((tuple(i), self.r_i(i,P,dpmi,r_p)) for i in I)
+        return [instance_doc(i, it, score) for i, score in top_n(scores, n)]
+
+
+class SparseReliabilityScorer(ReliabilityScorer):
+    '''
+    Ranks candidates by the same reliability scores as ReliabilityScorer,
+    calculated as sparse matrix-vector products over the dpmi submatrix D
+    of candidate instances I (rows) and patterns P (columns), which is
+    built once per ranking:
+
+    (1) r_i = D . r_p / (max_pmi * len(P))
+
+    (2) r_p = D^T . r_i / (max_pmi * len(I))
+
+    (3) S = D . r_p / sum(r_p)
+
+    Requires numpy and scipy.
+    '''
+    __short__ = 'srel'
+
+    def submatrix(self, I, P):
+        '''returns the len(I) x len(P) sparse dpmi submatrix of I*P'''
+        return self.pmi.submatrix(I, P, 'dpmi')
+
+    def r_i_vector(self, I, P, D=None):
+        '''returns an array of r_i for every instance in I'''
+        import numpy
+        if D is None:
+            D = self.submatrix(I, P)
+        r_p = self._r_p_many(P)
+        r_p = numpy.array([r_p[p] for p in P], dtype=numpy.float64)
+        return D.dot(r_p) / (self.max_pmi * len(P))
+
+    def r_p_vector(self, I, P, D=None):
+        '''returns an array of r_p for every pattern in P'''
+        import numpy
+        if D is None:
+            D = self.submatrix(I, P)
+        r_i = self._r_i_many(I)
+        r_i = numpy.array([r_i[tuple(i)] for i in I], dtype=numpy.float64)
+        return D.T.dot(r_i) / (self.max_pmi * len(I))
+
+    def S_vector(self, I, P, D=None):
+        '''returns an array of the confidence in every instance in I'''
+        import numpy
+        if D is None:
+            D = self.submatrix(I, P)
+        r_p = self._r_p_many(P)
+        r_p = numpy.array([r_p[p] for p in P], dtype=numpy.float64)
+        return D.dot(r_p) / r_p.sum()
+
+    def rank_patterns(self, I, P, it, n=None):
+        '''return a list of the top n patterns ranked by reliability score'''
+        scores = self.r_p_vector(I, P)
+        for p, score in zip(P, scores):
+            self.logger.info('r_p: %s %f' % (p, score))
+        scores = ((p, float(score)) for p, score in zip(P, scores))
+        return [pattern_doc(p, it, score) for p, score in top_n(scores, n)]
+
+    def rank_instances(self, I, P, it, n=None):
+        '''return a list of the top n instances ranked by reliability
+        score'''
+        scores = self.r_i_vector(I, P)
+        for i, score in zip(I, scores):
+            self.logger.info('r_i: %s %f' % (tuple(i), score))
+        scores = ((tuple(i), float(score)) for i, score in zip(I, scores))
+        return [instance_doc(i, it, score) for i, score in top_n(scores, n)]
@@ -0,0 +1,226 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Author: Eric Nichols, <eric@ecei.tohoku.ac.jp>
+################################################################################
+
+'''
+`sparse_pmi.py`: calculates co-occurence frequencies and discounted PMI
+between relation patterns and argument tuples as vectorized operations
+over a sparse instance*pattern matrix
+
+### Sparse Matrix
+
+The co-occurence matrix is loaded as a CSR matrix with a row for each
+argument instance and a column for each relation pattern, numbered in
+sorted order. Instance and pattern frequencies are its row and column
+sums, and PMI, discount, and discounted PMI are calculated over all of
+its non-zero entries at once.
+
+### Artifact
+
+The matrix and its scores are saved to a directory of uncompressed
+numpy arrays that can be loaded with `load_artifact`, optionally as
+read-only memory maps:
+
+* `indptr.npy`, `indices.npy`: CSR structure of the matrix
+* `T_indptr.npy`, `T_indices.npy`: CSC structure of the matrix, listing
+  the instances of each pattern
+* `F_ip.npy`, `pmi.npy`, `discount.npy`, `dpmi.npy`: values of non-zero
+  entries in CSR order
+* `F_i.npy`, `F_p.npy`: instance and pattern frequencies
+* `instances.npy`: instance labels with arguments joined by tabs, in
+  sorted order so that they can be searched with `numpy.searchsorted`
+* `patterns.npy`: pattern labels in sorted order
+* `meta.json`: matrix name, argument names, F_all, maximum dpmi, and
+  whether the matrix stores vocabulary ids
+'''
+
+import json
+import numpy
+import os
+import sys
+from array import array
+from bson.son import SON
+from scipy import sparse
+
+import mongodb
+
+ARRAYS = ('indptr', 'indices', 'T_indptr', 'T_indices', 'F_ip', 'pmi',
+          'discount', 'dpmi', 'F_i', 'F_p', 'instances', 'patterns')
+
+def sort_keys(ids, label):
+    '''returns the keys of a dictionary mapping keys to ids sorted by
+    their labels and an array mapping each id to the position of its
+    key'''
+    keys = sorted(ids, key=label)
+    rank = numpy.empty(len(keys), dtype=numpy.int64)
+    for n, k in enumerate(keys):
+        rank[ids[k]] = n
+    return keys, rank
+
+def value2label(x):
+    '''returns a pattern, argument, or vocabulary id as a utf-8 string'''
+    return unicode(x).encode('utf-8')
+
+def instance2label(i):
+    '''returns an instance as a tab-delimited utf-8 string'''
+    return '\t'.join(value2label(a) for a in i)
+
+def label2value(label, encoded=False):
+    '''returns the pattern, argument, or vocabulary id of a label'''
+    return int(label) if encoded else label.decode('utf-8')
+
+def label2instance(label, encoded=False):
+    '''returns a tuple of arguments from an instance label'''
+    return tuple(label2value(a, encoded) for a in label.split('\t'))
+
+
+class SparsePMI:
+    def __init__(self, pmi):
+        '''initializes class with the collection names and arguments of
+        a matrix2pmi.PMI'''
+        self.pmi = pmi
+        self.db = pmi.db
+        self.argv = pmi.argv
+        self.batch = pmi.batch
+
+    def load(self):
+        '''loads <matrix> as a sparse instance*pattern matrix of summed
+        scores'''
+        print >>sys.stderr, '%s: loading sparse matrix...' % self.pmi.fullname
+        I, P = {}, {}
+        rows, cols, scores = array('l'), array('l'), array('d')
+        progress = mongodb.Throughput('documents loaded')
+        xs = mongodb.fast_find(self.db, self.pmi.matrix, batch=self.batch,
+                               fields=['rel', 'score'] + self.argv)
+        for x in xs:
+            i = tuple(x[a] for a in self.argv)
+            rows.append(I.setdefault(i, len(I)))
+            cols.append(P.setdefault(x['rel'], len(P)))
+            scores.append(x['score'])
+            progress.update()
+        progress.report()
+        self.instances, row_rank = sort_keys(I, instance2label)
+        self.patterns, col_rank = sort_keys(P, value2label)
+        rows = row_rank[numpy.frombuffer(rows, dtype=numpy.int_)]
+        cols = col_rank[numpy.frombuffer(cols, dtype=numpy.int_)]
+        # duplicate (row, col) entries are summed
+        self.F = sparse.csr_matrix(
+            (numpy.frombuffer(scores, dtype=numpy.float64), (rows, cols)),
+            shape=(len(self.instances), len(self.patterns))
+            )
+        self.F.sum_duplicates()
+        print >>sys.stderr, '%s: loading sparse matrix: done. %d x %d, %d non-zero' % \
+            (self.pmi.fullname, self.F.shape[0], self.F.shape[1], self.F.nnz)
+
+    def calculate(self):
+        '''calculates frequencies and discounted PMI for all non-zero
+        entries of the matrix'''
+        print >>sys.stderr, '%s: calculating sparse PMI...' % self.pmi.fullname
+        F = self.F
+        self.F_all = float(F.sum())
+        self.F_i = numpy.asarray(F.sum(axis=1)).ravel()
+        self.F_p = numpy.asarray(F.sum(axis=0)).ravel()
+        rows = numpy.repeat(numpy.arange(F.shape[0]), numpy.diff(F.indptr))
+        F_ip = F.data
+        F_i = self.F_i[rows]
+        F_p = self.F_p[F.indices]
+        # see PMI._calc_pmi and PMI._discount
+        P_ip = F_ip / self.F_all
+        self.pmi_ = numpy.log( P_ip / ((F_i/self.F_all)*(F_p/self.F_all)) )
+        c_min = numpy.minimum(F_i, F_p)
+        self.discount = (F_ip/(F_ip+1.0)) * (c_min/(c_min+1.0))
+        self.dpmi = self.pmi_ * self.discount
+        self.max_dpmi = max(0.0, float(self.dpmi.max())) if F.nnz else 0.0
+        print >>sys.stderr, '%s: calculating sparse PMI: done.' % self.pmi.fullname
+
+    def save(self):
+        '''saves frequencies and discounted PMI to the same collections
+        as matrix2pmi.PMI'''
+        print >>sys.stderr, '%s: saving sparse PMI...' % self.pmi.fullname
+        p = self.pmi
+        for c in (p._F_all, p._F_i, p._F_p, p._F_ip, p._pmi_ip):
+            self.db.drop_collection(c)
+        writer = mongodb.BulkWriter(self.db, self.batch)
+        writer.insert(p._F_all, {'_id': 'all', 'value': {'score': self.F_all}})
+        p.F_all = self.F_all
+        for i, score in zip(self.instances, self.F_i):
+            writer.insert(p._F_i, {'_id': p.key2id('F_i', i),
+                                   'value': {'score': float(score)}})
+        for r, score in zip(self.patterns, self.F_p):
+            writer.insert(p._F_p, {'_id': p.key2id('F_p', (r, )),
+                                   'value': {'score': float(score)}})
+        F = self.F
+        progress = mongodb.Throughput('PMI scores saved')
+        for row, i in enumerate(self.instances):
+            args = zip(self.argv, i)
+            for k in xrange(F.indptr[row], F.indptr[row+1]):
+                r = self.patterns[F.indices[k]]
+                writer.insert(p._F_ip, {'_id': p.key2id('F_ip', (r, ) + i),
+                                        'value': {'score': float(F.data[k])}})
+                y = SON([('rel', r), ] + args +
+                        [('dpmi', float(self.dpmi[k])),
+                         ('discount', float(self.discount[k])),
+                         ('pmi', float(self.pmi_[k]))])
+                writer.insert(p._pmi_ip, y)
+                progress.update()
+        writer.flush()
+        progress.report()
+        p.cache.clear()
+        p.save_max_pmi(self.max_dpmi)
+        p.index_F_ip()
+        p.index_pmi_ip()
+        print >>sys.stderr, '%s: saving sparse PMI: done.' % self.pmi.fullname
+
+    def arrays(self):
+        '''returns a dictionary of the arrays of the artifact'''
+        T = self.F.tocsc()
+        return {
+            'indptr': self.F.indptr,
+            'indices': self.F.indices,
+            'T_indptr': T.indptr,
+            'T_indices': T.indices,
+            'F_ip': self.F.data,
+            'pmi': self.pmi_,
+            'discount': self.discount,
+            'dpmi': self.dpmi,
+            'F_i': self.F_i,
+            'F_p': self.F_p,
+            'instances': numpy.array([instance2label(i)
+                                      for i in self.instances]),
+            'patterns': numpy.array([value2label(r)
+                                     for r in self.patterns]),
+            }
+
+    def meta(self):
+        '''returns a dictionary of the metadata of the artifact'''
+        encoded = bool(self.patterns) and isinstance(self.patterns[0], (int, long))
+        return {'matrix': self.pmi.matrix, 'argv': self.argv,
+                'F_all': self.F_all, 'max_dpmi': self.max_dpmi,
+                'shape': list(self.F.shape), 'encoded': encoded}
+
+    def save_artifact(self, path):
+        '''saves the matrix and its scores to a directory of numpy arrays'''
+        print >>sys.stderr, '%s: saving artifact to %s ...' % \
+            (self.pmi.fullname, path)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        arrays = self.arrays()
+        for name in ARRAYS:
+            numpy.save(os.path.join(path, '%s.npy' % name), arrays[name])
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump(self.meta(), f)
+        print >>sys.stderr, '%s: saving artifact to %s: done.' % \
+            (self.pmi.fullname, path)
+
+
+def load_artifact(path, mmap_mode=None):
+    '''returns the metadata and a dictionary of arrays saved by
+    SparsePMI.save_artifact, memory mapping them with mmap_mode if it is
+    given'''
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    arrays = {name:numpy.load(os.path.join(path, '%s.npy' % name),
+                              mmap_mode=mmap_mode)
+              for name in ARRAYS}
+    return meta, arrays
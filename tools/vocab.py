@@ -0,0 +1,128 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Author: Eric Nichols, <eric@ecei.tohoku.ac.jp>
+################################################################################
+
+'''
+`vocab.py`: assigns compact integer ids to relation patterns and
+argument strings
+
+### Vocabulary
+
+A matrix created with `instances2matrix.py --encode` stores the id of
+each `rel` and `argN` string instead of the string itself, so its
+frequency, PMI, and bootstrapping collections store, index, and join
+on ids as well. The ids are kept in `<collection>_vocab` with the
+following fields:
+
+* `_id`: integer id
+* `s`: relation pattern or argument string
+
+Ids start at 1 and are allocated in blocks from a counter document
+with an `_id` of `__next__`, and a unique index on `s` ensures that
+processes encoding the same string concurrently agree on its id.
+Strings are decoded only when results are exported.
+'''
+
+import re
+from pymongo.errors import DuplicateKeyError
+
+from mongodb import chunks
+
+def vocab_name(collection):
+    '''returns the name of the vocabulary collection for collection'''
+    return '%s_vocab' % collection
+
+
+class Vocabulary:
+    def __init__(self, db, collection, block=1000, batch=1000):
+        '''initializes the vocabulary of collection, allocating ids in
+        blocks of size block and looking up strings in batches of size
+        batch'''
+        self.db = db
+        self.coll = vocab_name(collection)
+        self.block = block
+        self.batch = batch
+        self.ids = {}
+        self.strings = {}
+        self.next = self.stop = 0
+        self.db[self.coll].ensure_index('s', unique=True, sparse=True)
+
+    def allocate(self):
+        '''returns an unused id, reserving a new block of ids if needed.
+        ids start at 1'''
+        if self.next == self.stop:
+            r = self.db[self.coll].find_and_modify(
+                {'_id': '__next__'}, {'$inc': {'n': self.block}},
+                upsert=True, new=True
+                )
+            # the counter is the last id of the block
+            self.stop = r['n'] + 1
+            self.next = self.stop - self.block
+        id_ = self.next
+        self.next += 1
+        return id_
+
+    def remember(self, docs):
+        '''caches the string and id of vocabulary documents'''
+        for x in docs:
+            self.ids[x['s']] = x['_id']
+            self.strings[x['_id']] = x['s']
+
+    def lookup_many(self, strings):
+        '''returns a dictionary mapping the strings in the vocabulary to
+        their ids, without adding strings that are not in it'''
+        missing = [s for s in set(strings) if s not in self.ids]
+        for chunk in chunks(missing, self.batch):
+            self.remember(self.db[self.coll].find({'s': {'$in': chunk}}))
+        return {s:self.ids[s] for s in strings if s in self.ids}
+
+    def encode_many(self, strings):
+        '''returns a dictionary mapping strings to their ids, adding
+        strings that are not in the vocabulary'''
+        self.lookup_many(strings)
+        missing = [s for s in set(strings) if s not in self.ids]
+        for new in chunks(missing, self.batch):
+            docs = [{'_id': self.allocate(), 's': s} for s in new]
+            try:
+                self.db[self.coll].insert(docs, continue_on_error=True)
+                self.remember(docs)
+            except DuplicateKeyError:
+                # another process added some of the strings first
+                self.remember(self.db[self.coll].find({'s': {'$in': new}}))
+        return {s:self.ids[s] for s in strings}
+
+    def encode(self, s):
+        '''returns the id of s, adding it to the vocabulary if needed'''
+        return self.encode_many([s])[s]
+
+    def decode_many(self, ids):
+        '''returns a dictionary mapping ids to their strings'''
+        missing = [i for i in set(ids) if i not in self.strings]
+        for chunk in chunks(missing, self.batch):
+            self.remember(self.db[self.coll].find({'_id': {'$in': chunk}}))
+        return {i:self.strings.get(i, i) for i in ids}
+
+    def decode(self, id_):
+        '''returns the string with id id_'''
+        return self.decode_many([id_])[id_]
+
+    def encode_instance(self, i):
+        '''returns a tuple of the ids of the arguments in instance i'''
+        ids = self.encode_many(i)
+        return tuple(ids[a] for a in i)
+
+    def decode_instance(self, i):
+        '''returns a tuple of the argument strings of instance i'''
+        strings = self.decode_many(i)
+        return tuple(strings[a] for a in i)
+
+
+def open_vocabulary(db, matrix):
+    '''returns the Vocabulary of matrix or of the <collection> of a matrix
+    named <collection>_<argc>, or None if matrix is not encoded'''
+    names = db.collection_names()
+    for c in (matrix, re.sub('_[0-9]+$', '', matrix)):
+        if vocab_name(c) in names:
+            return Vocabulary(db, c)
+    return None